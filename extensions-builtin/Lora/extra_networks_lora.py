@@ -25,24 +25,32 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
         unet_multipliers = []
         dyn_dims = []
         for params in params_list:
-            assert params.items
-
-            names.append(params.positional[0])
-
-            te_multiplier = float(params.positional[1]) if len(params.positional) > 1 else 1.0
-            te_multiplier = float(params.named.get("te", te_multiplier))
-
-            unet_multiplier = float(params.positional[2]) if len(params.positional) > 2 else te_multiplier
-            unet_multiplier = float(params.named.get("unet", unet_multiplier))
-
-            dyn_dim = int(params.positional[3]) if len(params.positional) > 3 else None
-            dyn_dim = int(params.named["dyn"]) if "dyn" in params.named else dyn_dim
+            name, te_multiplier, unet_multiplier, dyn_dim = self.parse_params(params)
 
+            names.append(name)
             te_multipliers.append(te_multiplier)
             unet_multipliers.append(unet_multiplier)
             dyn_dims.append(dyn_dim)
 
+        batch_item_multipliers = None
+        if shared.opts.lora_runtime:
+            batch_item_multipliers = self.batch_item_multipliers(p, additional)
+
+            # text encoder runs with networks of the first prompt, so if prompts differ in that, all images use those networks
+            if any(self.te_networks(x) != self.te_networks(batch_item_multipliers[0]) for x in batch_item_multipliers):
+                batch_item_multipliers = None
+
+            # networks used by other images in batch are loaded too, with no effect on the text encoder
+            for item_params in batch_item_multipliers or []:
+                for name in item_params:
+                    if name not in names:
+                        names.append(name)
+                        te_multipliers.append(0.0)
+                        unet_multipliers.append(0.0)
+                        dyn_dims.append(None)
+
         networks.load_networks(names, te_multipliers, unet_multipliers, dyn_dims)
+        networks.set_batch_item_multipliers(batch_item_multipliers)
 
         if shared.opts.lora_add_hashes_to_infotext:
             if not getattr(p, "is_hr_pass", False) or not hasattr(p, "lora_hashes"):
@@ -55,7 +63,58 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
             if p.lora_hashes:
                 p.extra_generation_params["Lora hashes"] = ', '.join(f'{k}: {v}' for k, v in p.lora_hashes.items())
 
+    def parse_params(self, params):
+        """Returns name, te multiplier, unet multiplier and dyn dim from arguments of a <lora:...> in prompt."""
+
+        assert params.items
+
+        name = params.positional[0]
+
+        te_multiplier = float(params.positional[1]) if len(params.positional) > 1 else 1.0
+        te_multiplier = float(params.named.get("te", te_multiplier))
+
+        unet_multiplier = float(params.positional[2]) if len(params.positional) > 2 else te_multiplier
+        unet_multiplier = float(params.named.get("unet", unet_multiplier))
+
+        dyn_dim = int(params.positional[3]) if len(params.positional) > 3 else None
+        dyn_dim = int(params.named["dyn"]) if "dyn" in params.named else dyn_dim
+
+        return name, te_multiplier, unet_multiplier, dyn_dim
+
+    def per_item_params(self, params):
+        """Returns True if the network from params can be different for each image in batch with lora_runtime: that's only possible for networks that do not change the text encoder."""
+
+        _, te_multiplier, _, _ = self.parse_params(params)
+        return te_multiplier == 0
+
+    def te_networks(self, item):
+        """Returns names and te multipliers of networks that change the text encoder, from an element of the list returned by batch_item_multipliers()."""
+
+        return {name: te_multiplier for name, (te_multiplier, _) in item.items() if te_multiplier != 0}
+
+    def batch_item_multipliers(self, p, additional):
+        """Returns a list with a dict of network name -> (te multiplier, unet multiplier) for each prompt in the current batch."""
+
+        all_prompts = p.all_hr_prompts if getattr(p, "is_hr_pass", False) else p.all_prompts
+        prompts = all_prompts[p.iteration * p.batch_size:(p.iteration + 1) * p.batch_size]
+
+        res = []
+        for prompt in prompts:
+            item = {}
+            for params in extra_networks.parse_prompt(prompt)[1].get(self.name, []):
+                name, te_multiplier, unet_multiplier, _ = self.parse_params(params)
+                item[name] = (te_multiplier, unet_multiplier)
+
+            if additional != "None" and additional in networks.available_networks and additional not in item:
+                item[additional] = (shared.opts.extra_networks_default_multiplier, shared.opts.extra_networks_default_multiplier)
+
+            res.append(item)
+
+        return res
+
     def deactivate(self, p):
+        networks.set_batch_item_multipliers(None)
+
         if self.errors:
             p.comment("Networks with errors: " + ", ".join(f"{k} ({v})" for k, v in self.errors.items()))
 
@@ -6,7 +6,7 @@ import enum
 import torch.nn as nn
 import torch.nn.functional as F
 
-from modules import sd_models, cache, errors, hashes, shared
+from modules import sd_models, cache, errors, hashes, shared, hashing_service
 import modules.models.sd3.mmdit
 
 NetworkWeights = namedtuple('NetworkWeights', ['network_key', 'sd_key', 'w', 'sd_module'])
@@ -22,41 +22,58 @@ class SdVersion(enum.Enum):
 
 
 class NetworkOnDisk:
-    def __init__(self, name, filename):
+    def __init__(self, name, filename, index_entry=None):
+        """index_entry is a dict from index_entry() of an earlier object for the same version of the file; if it's provided, the file is not read."""
+
         self.name = name
         self.filename = filename
-        self.metadata = {}
+        self._metadata = None
         self.is_safetensors = os.path.splitext(filename)[1].lower() == ".safetensors"
 
-        def read_metadata():
-            metadata = sd_models.read_metadata_from_safetensors(filename)
-
-            return metadata
-
-        if self.is_safetensors:
-            try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "lora/" + self.name, filename, read_metadata)
-            except Exception as e:
-                errors.display(e, f"reading lora {filename}")
-
-        if self.metadata:
-            m = {}
-            for k, v in sorted(self.metadata.items(), key=lambda x: metadata_tags_order.get(x[0], 999)):
-                m[k] = v
-
-            self.metadata = m
-
-        self.alias = self.metadata.get('ss_output_name', self.name)
+        if index_entry is not None:
+            # metadata is only read when it's needed
+            self.alias = index_entry["alias"]
+            self.sd_version = SdVersion[index_entry["sd_version"]]
+            known_hash = index_entry["hash"]
+        else:
+            self.alias = self.metadata.get('ss_output_name', self.name)
+            self.sd_version = self.detect_version()
+            known_hash = self.metadata.get('sshs_model_hash')
 
         self.hash = None
         self.shorthash = None
         self.set_hash(
-            self.metadata.get('sshs_model_hash') or
+            known_hash or
             hashes.sha256_from_cache(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or
             ''
         )
 
-        self.sd_version = self.detect_version()
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = self.read_metadata()
+
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
+    def read_metadata(self):
+        metadata = None
+
+        if self.is_safetensors:
+            try:
+                metadata = cache.cached_data_for_file('safetensors-metadata', "lora/" + self.name, self.filename, lambda: sd_models.read_metadata_from_safetensors(self.filename))
+            except Exception as e:
+                errors.display(e, f"reading lora {self.filename}")
+
+        return dict(sorted((metadata or {}).items(), key=lambda x: metadata_tags_order.get(x[0], 999)))
+
+    def index_entry(self):
+        """Returns what is needed to recreate this object without reading the file."""
+
+        return {"alias": self.alias, "sd_version": self.sd_version.name, "hash": self.hash}
 
     def detect_version(self):
         if str(self.metadata.get('ss_base_model_version', "")).startswith("sdxl_"):
@@ -78,7 +95,7 @@ class NetworkOnDisk:
 
     def read_hash(self):
         if not self.hash:
-            self.set_hash(hashes.sha256(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or '')
+            self.set_hash(hashing_service.sha256(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors, callback=self.set_hash) or '')
 
     def get_alias(self):
         import networks
@@ -99,6 +116,12 @@ class Network:  # LoraModule
         self.bundle_embeddings = {}
         self.mtime = None
 
+        self.mapped = False
+        """weights are memory-mapped from the file rather than loaded into memory"""
+
+        self.size = 0
+        """bytes of memory used by weights, not counting memory-mapped ones"""
+
         self.mentioned_name = None
         """the text that was used to add the network to prompt - can be either name or an alias"""
 
@@ -158,11 +181,24 @@ class NetworkModule:
         self.dora_scale = weights.w.get("dora_scale", None)
         self.dora_norm_dims = len(self.shape) - 1
 
+        self.fixed_multiplier = None
+        """if set, used instead of the network's multiplier"""
+
     def multiplier(self):
+        if self.fixed_multiplier is not None:
+            return self.fixed_multiplier
+
+        return self.multiplier_for(self.network.te_multiplier, self.network.unet_multiplier)
+
+    def multiplier_for(self, te_multiplier, unet_multiplier):
         if 'transformer' in self.sd_key[:20]:
-            return self.network.te_multiplier
+            return te_multiplier
         else:
-            return self.network.unet_multiplier
+            return unet_multiplier
+
+    def updown_depends_on_weight(self):
+        """Whether calc_updown result depends on values in the layer's weight rather than only on its shape; if not, the result is proportional to multiplier."""
+        return self.dora_scale is not None
 
     def calc_scale(self):
         if self.scale is not None:
@@ -226,3 +262,36 @@ class NetworkModule:
             updown, ex_bias = self.calc_updown(self.sd_module.weight)
             return y + self.ops(x, weight=updown, bias=ex_bias, **self.extra_kwargs)
 
+    def supports_forward(self):
+        """Whether forward() works for this module; if not, the module can only be applied by changing the layer's weight."""
+
+        return self.ops is not None or type(self).forward is not NetworkModule.forward
+
+    def forward_per_sample(self, x, y, multipliers):
+        """Same as forward, but with a separate multiplier for each item in batch; multipliers is a tensor with a value for each row of x."""
+
+        if self.updown_depends_on_weight():
+            # output of forward is not necessarily proportional to multiplier, so it is calculated for each multiplier separately
+            res = y.clone()
+            for value in multipliers.unique().tolist():
+                if value == 0:
+                    continue
+
+                rows = multipliers == value
+                self.fixed_multiplier = value
+                try:
+                    res[rows] = self.forward(x[rows], y[rows])
+                finally:
+                    self.fixed_multiplier = None
+
+            return res
+
+        self.fixed_multiplier = 1.0
+        try:
+            # output of forward is proportional to multiplier, so it is calculated once and scaled for each row
+            delta = self.forward(x, 0)
+        finally:
+            self.fixed_multiplier = None
+
+        return y + delta * multipliers.reshape(-1, *[1] * (delta.dim() - 1))
+
@@ -21,6 +21,9 @@ class NetworkModuleGLora(network.NetworkModule):
         self.w2a = weights.w["a2.weight"]
         self.w2b = weights.w["b2.weight"]
 
+    def updown_depends_on_weight(self):
+        return True
+
     def calc_updown(self, orig_weight):
         w1a = self.w1a.to(orig_weight.device)
         w1b = self.w1b.to(orig_weight.device)
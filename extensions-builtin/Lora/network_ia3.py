@@ -16,6 +16,9 @@ class NetworkModuleIa3(network.NetworkModule):
         self.w = weights.w["weight"]
         self.on_input = weights.w["on_input"].item()
 
+    def updown_depends_on_weight(self):
+        return True
+
     def calc_updown(self, orig_weight):
         w = self.w.to(orig_weight.device)
 
@@ -3,7 +3,7 @@ import torch
 import lyco_helpers
 import modules.models.sd3.mmdit
 import network
-from modules import devices
+from modules import devices, shared
 
 
 class ModuleTypeLora(network.ModuleType):
@@ -58,6 +58,11 @@ class NetworkModuleLora(network.NetworkModule):
         else:
             raise AssertionError(f'Lora layer {self.network_key} matched a layer with unsupported type: {type(self.sd_module).__name__}')
 
+        if (shared.opts.shared_weights or self.network.mapped) and weight.device == devices.cpu and weight.dtype == devices.dtype:
+            # use memory mapped from the file instead of a copy
+            module.weight = torch.nn.Parameter(weight.reshape(module.weight.shape), requires_grad=False)
+            return module
+
         with torch.no_grad():
             if weight.shape != module.weight.shape:
                 weight = weight.reshape(module.weight.shape)
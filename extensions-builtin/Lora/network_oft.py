@@ -67,6 +67,9 @@ class NetworkModuleOFT(network.NetworkModule):
             self.block_size = self.oft_blocks.shape[2]
             self.boft_b = self.block_size
 
+    def updown_depends_on_weight(self):
+        return True
+
     def calc_updown(self, orig_weight):
         oft_blocks = self.oft_blocks.to(orig_weight.device)
         eye = torch.eye(self.block_size, device=oft_blocks.device)
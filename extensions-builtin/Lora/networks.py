@@ -1,8 +1,13 @@
 from __future__ import annotations
+import concurrent.futures
 import gradio as gr
+import hashlib
+import itertools
 import logging
 import os
 import re
+import stat
+from collections import OrderedDict
 
 import lora_patches
 import network
@@ -18,7 +23,7 @@ import network_oft
 import torch
 from typing import Union
 
-from modules import shared, devices, sd_models, errors, scripts, sd_hijack
+from modules import shared, devices, sd_models, errors, scripts, sd_hijack, hashing_service, cache, hashes, sd_samplers_cfg_denoiser
 import modules.textual_inversion.textual_inversion as textual_inversion
 import modules.models.sd3.mmdit
 
@@ -36,6 +41,12 @@ module_types = [
 ]
 
 
+key_mapping_version = 1
+"""version of network_key_mapping(); cached mappings made by other versions are not used"""
+
+network_index_version = 1
+"""version of entries in the persistent index of network files; entries written by other versions are ignored"""
+
 re_digits = re.compile(r"\d+")
 re_x_proj = re.compile(r"(.*)_([qkv]_proj)$")
 re_compiled = {}
@@ -146,6 +157,11 @@ def assign_network_names_to_compvis_modules(sd_model):
 
     sd_model.network_layer_mapping = network_layer_mapping
 
+    # identifies the set of layer names, for caching how networks' keys map to layers
+    has_diffusers_weight_map = hasattr(sd_model, 'diffusers_weight_map') or hasattr(sd_model, 'diffusers_weight_mapping')
+    layout = "\n".join(sorted(network_layer_mapping)) + f"\ndiffusers:{has_diffusers_weight_map}"
+    sd_model.network_layer_mapping_id = hashlib.sha256(layout.encode("utf8")).hexdigest()[:16]
+
 
 class BundledTIHash(str):
     def __init__(self, hash_str):
@@ -155,17 +171,14 @@ class BundledTIHash(str):
         return self.hash if shared.opts.lora_bundled_ti_to_infotext else ''
 
 
-def load_network(name, network_on_disk):
-    net = network.Network(name, network_on_disk)
-    net.mtime = os.path.getmtime(network_on_disk.filename)
-
-    sd = sd_models.read_state_dict(network_on_disk.filename)
-
-    # this should not be needed but is here as an emergency fix for an unknown error people are experiencing in 1.2.0
-    if not hasattr(shared.sd_model, 'network_layer_mapping'):
-        assign_network_names_to_compvis_modules(shared.sd_model)
+def network_key_mapping(sd_keys):
+    """
+    Works out where keys of a network's state dict go in the current model. Returns a dict with:
+     - "modules": state dict key -> (network module key, key within the module's weights, name of the model's layer),
+     - "bundle_emb": state dict key -> key within bundled embeddings,
+     - "failed": state dict key -> layer name that was not found in the model.
+    """
 
-    keys_failed_to_match = {}
     is_sd2 = 'model_transformer_resblocks' in shared.sd_model.network_layer_mapping
     if hasattr(shared.sd_model, 'diffusers_weight_map'):
         diffusers_weight_map = shared.sd_model.diffusers_weight_map
@@ -177,10 +190,9 @@ def load_network(name, network_on_disk):
     else:
         diffusers_weight_map = None
 
-    matched_networks = {}
-    bundle_embeddings = {}
+    res = {"modules": {}, "bundle_emb": {}, "failed": {}}
 
-    for key_network, weight in sd.items():
+    for key_network in sd_keys:
 
         if diffusers_weight_map:
             key_network_without_network_parts, network_name, network_weight = key_network.rsplit(".", 2)
@@ -189,14 +201,7 @@ def load_network(name, network_on_disk):
             key_network_without_network_parts, _, network_part = key_network.partition(".")
 
         if key_network_without_network_parts == "bundle_emb":
-            emb_name, vec_name = network_part.split(".", 1)
-            emb_dict = bundle_embeddings.get(emb_name, {})
-            if vec_name.split('.')[0] == 'string_to_param':
-                _, k2 = vec_name.split('.', 1)
-                emb_dict['string_to_param'] = {k2: weight}
-            else:
-                emb_dict[vec_name] = weight
-            bundle_embeddings[emb_name] = emb_dict
+            res["bundle_emb"][key_network] = network_part
 
         if diffusers_weight_map:
             key = diffusers_weight_map.get(key_network_without_network_parts, key_network_without_network_parts)
@@ -235,26 +240,109 @@ def load_network(name, network_on_disk):
             sd_module = shared.sd_model.network_layer_mapping.get(key, None)
 
         if sd_module is None:
-            keys_failed_to_match[key_network] = key
+            res["failed"][key_network] = key
             continue
 
+        # the layer is stored by name rather than as the module object, so that the mapping can be cached
+        res["modules"][key_network] = (key, network_part, sd_module.network_layer_name)
+
+    return res
+
+
+def cached_network_key_mapping(network_on_disk, sd_keys):
+    """
+    Returns network_key_mapping() for a network file, cached on disk per version of the file and layout of the model's
+    layers, along with a key to store it under. The mapping also has "module_types": network module key -> name of ModuleType
+    class that accepted the layer's weights, once the network has been loaded.
+    """
+
+    model_layout = getattr(shared.sd_model, 'network_layer_mapping_id', None)
+    if model_layout is None:
+        return network_key_mapping(sd_keys), None
+
+    cache_key = f"{key_mapping_version}:{hashes.stat_key(os.stat(network_on_disk.filename))}:{model_layout}"
+
+    mapping = cache.cache("lora-key-mapping").get(cache_key)
+    if mapping is None:
+        mapping = network_key_mapping(sd_keys)
+
+    return mapping, cache_key
+
+
+def load_network(name, network_on_disk, mapped=False):
+    """Loads a network from disk; if mapped is True, which is only possible for .safetensors files, weights are memory-mapped from the file where possible."""
+
+    net = network.Network(name, network_on_disk)
+    net.mtime = os.path.getmtime(network_on_disk.filename)
+    net.mapped = mapped
+
+    if mapped:
+        sd = sd_models.read_safetensors_mmap(network_on_disk.filename)
+    else:
+        # with shared_weights, Lora weights stay mapped from the file so that processes share their memory
+        sd = sd_models.read_state_dict(network_on_disk.filename, map_location="cpu" if shared.opts.shared_weights else None)
+
+    # this should not be needed but is here as an emergency fix for an unknown error people are experiencing in 1.2.0
+    if not hasattr(shared.sd_model, 'network_layer_mapping'):
+        assign_network_names_to_compvis_modules(shared.sd_model)
+
+    mapping, mapping_cache_key = cached_network_key_mapping(network_on_disk, list(sd))
+    mapping_changed = "module_types" not in mapping
+    module_types_by_layer = mapping.setdefault("module_types", {})
+
+    matched_networks = {}
+    bundle_embeddings = {}
+
+    for key_network, weight in sd.items():
+        network_part = mapping["bundle_emb"].get(key_network)
+        if network_part is not None:
+            emb_name, vec_name = network_part.split(".", 1)
+            emb_dict = bundle_embeddings.get(emb_name, {})
+            if vec_name.split('.')[0] == 'string_to_param':
+                _, k2 = vec_name.split('.', 1)
+                emb_dict['string_to_param'] = {k2: weight}
+            else:
+                emb_dict[vec_name] = weight
+            bundle_embeddings[emb_name] = emb_dict
+
+        target = mapping["modules"].get(key_network)
+        if target is None:
+            continue
+
+        key, network_part, layer_name = target
         if key not in matched_networks:
-            matched_networks[key] = network.NetworkWeights(network_key=key_network, sd_key=key, w={}, sd_module=sd_module)
+            matched_networks[key] = network.NetworkWeights(network_key=key_network, sd_key=key, w={}, sd_module=shared.sd_model.network_layer_mapping[layer_name])
 
         matched_networks[key].w[network_part] = weight
 
+    module_types_by_name = {type(x).__name__: x for x in module_types}
+
     for key, weights in matched_networks.items():
         net_module = None
-        for nettype in module_types:
+
+        nettype = module_types_by_name.get(module_types_by_layer.get(key))
+        if nettype is not None:
             net_module = nettype.create_module(net, weights)
-            if net_module is not None:
-                break
+
+        if net_module is None:
+            for nettype in module_types:
+                net_module = nettype.create_module(net, weights)
+                if net_module is not None:
+                    module_types_by_layer[key] = type(nettype).__name__
+                    mapping_changed = True
+                    break
 
         if net_module is None:
             raise AssertionError(f"Could not find a module type (out of {', '.join([x.__class__.__name__ for x in module_types])}) that would accept those keys: {', '.join(weights.w)}")
 
         net.modules[key] = net_module
 
+    if mapping_changed and mapping_cache_key is not None:
+        try:
+            cache.cache("lora-key-mapping")[mapping_cache_key] = mapping
+        except Exception:
+            errors.report(f"Failed to cache key mapping for {network_on_disk.filename}", exc_info=True)
+
     embeddings = {}
     for emb_name, data in bundle_embeddings.items():
         embedding = textual_inversion.create_embedding_from_data(data, emb_name, filename=network_on_disk.filename + "/" + emb_name)
@@ -264,17 +352,82 @@ def load_network(name, network_on_disk):
 
     net.bundle_embeddings = embeddings
 
-    if keys_failed_to_match:
-        logging.debug(f"Network {network_on_disk.filename} didn't match keys: {keys_failed_to_match}")
+    if mapping["failed"]:
+        logging.debug(f"Network {network_on_disk.filename} didn't match keys: {mapping['failed']}")
+
+    # tensors that still use memory of the file don't count
+    file_storages = {x.untyped_storage().data_ptr() for x in sd.values()} if mapped or shared.opts.shared_weights else set()
+    net.size = sum(x.nelement() * x.element_size() for x in network_tensors(net) if x.untyped_storage().data_ptr() not in file_storages)
 
     return net
 
 
+def network_tensors(net):
+    """Returns all tensors with weights of a network's modules."""
+
+    res = {}
+    for module in net.modules.values():
+        for field, value in vars(module).items():
+            if field == "sd_module":
+                continue
+
+            if isinstance(value, torch.Tensor):
+                res[id(value)] = value
+            elif isinstance(value, torch.nn.Module):
+                res.update((id(x), x) for x in value.parameters())
+
+    return list(res.values())
+
+
+def pinned_network_names():
+    return {x.strip() for x in shared.opts.lora_in_memory_pinned.split(",") if x.strip()}
+
+
+def networks_in_memory_over_limit():
+    pinned = pinned_network_names()
+    resident = [net for name, net in networks_in_memory.items() if not net.mapped and name not in pinned]
+
+    if shared.opts.lora_in_memory_limit_mb > 0:
+        return sum(net.size for net in resident) > shared.opts.lora_in_memory_limit_mb * 1024 * 1024
+
+    return len(resident) > shared.opts.lora_in_memory_limit
+
+
+def demote_network(name, net):
+    """Marks an evicted network to be loaded with weights memory-mapped from its file next time it's used, if lora_in_memory_mapped_limit allows it."""
+
+    if shared.opts.lora_in_memory_mapped_limit <= 0 or not net.network_on_disk.is_safetensors:
+        return
+
+    networks_demoted.pop(name, None)
+    networks_demoted[name] = True
+
+
 def purge_networks_from_memory():
-    while len(networks_in_memory) > shared.opts.lora_in_memory_limit and len(networks_in_memory) > 0:
-        name = next(iter(networks_in_memory))
+    """
+    Evicts least recently used networks from memory until the rest fit into limits; pinned networks are never evicted.
+    Evicted networks are demoted to memory-mapped form if lora_in_memory_mapped_limit allows it, and dropped otherwise.
+    The memory-mapped copy is only made when the network is used again, so eviction itself never loads anything.
+    """
+
+    pinned = pinned_network_names()
+
+    while networks_in_memory_over_limit():
+        name = next((name for name, net in networks_in_memory.items() if not net.mapped and name not in pinned), None)
+        if name is None:
+            break
+
+        demote_network(name, networks_in_memory.pop(name))
+
+    limit = max(shared.opts.lora_in_memory_mapped_limit, 0)
+
+    mapped = [name for name, net in networks_in_memory.items() if net.mapped and name not in pinned]
+    for name in mapped[:max(len(mapped) - limit, 0)]:
         networks_in_memory.pop(name, None)
 
+    for name in list(networks_demoted)[:max(len(networks_demoted) - limit, 0)]:
+        networks_demoted.pop(name, None)
+
     devices.torch_gc()
 
 
@@ -314,11 +467,17 @@ def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=No
 
         if network_on_disk is not None:
             if net is None:
-                net = networks_in_memory.get(name)
+                net = networks_in_memory.pop(name, None)
+                if net is not None:
+                    # move to the end, as the most recently used
+                    networks_in_memory[name] = net
 
             if net is None or os.path.getmtime(network_on_disk.filename) > net.mtime:
+                # a network that was evicted earlier is memory-mapped instead of being read into RAM again
+                mapped = networks_demoted.pop(name, False)
+
                 try:
-                    net = load_network(name, network_on_disk)
+                    net = load_network(name, network_on_disk, mapped=mapped)
 
                     networks_in_memory.pop(name, None)
                     networks_in_memory[name] = net
@@ -408,11 +567,131 @@ def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Li
         restore_weights_backup(self, 'bias', bias_backup)
 
 
+def network_weight_fields(self):
+    """Returns (object, attribute name) pairs for all tensors of a layer that networks change."""
+
+    if isinstance(self, torch.nn.MultiheadAttention):
+        return [(self, 'in_proj_weight'), (self.out_proj, 'weight'), (self.out_proj, 'bias')]
+
+    return [(self, 'weight'), (self, 'bias')]
+
+
+def merged_weights_cache_key(self, wanted_names):
+    if shared.opts.lora_merged_weights_cache_mb <= 0 or wanted_names == ():
+        return None
+
+    # an id that changes whenever the layer gets new weights, so that entries for old weights are never used
+    if getattr(self, "network_merged_weights_id", None) is None:
+        self.network_merged_weights_id = next(merged_weights_ids)
+
+    return self.network_merged_weights_id, wanted_names, tuple(net.mtime for net in loaded_networks)
+
+
+def store_merged_weights(self, key):
+    global merged_weights_cache_size
+
+    merged = tuple(store_weights_backup(getattr(obj, field, None)) for obj, field in network_weight_fields(self))
+    size = sum(x.nelement() * x.element_size() for x in merged if x is not None)
+    limit = shared.opts.lora_merged_weights_cache_mb * 1024 * 1024
+
+    if size > limit:
+        return
+
+    merged_weights_cache[key] = (merged, size)
+    merged_weights_cache_size += size
+
+    purge_merged_weights_cache()
+
+
+def restore_merged_weights(self, merged):
+    fields = network_weight_fields(self)
+
+    with torch.no_grad():
+        for (obj, field), weight in zip(fields, merged):
+            if weight is not None and getattr(obj, field, None) is None:
+                # bias added by a network to a layer that has none
+                weight_obj, weight_field = fields[0]
+                setattr(obj, field, torch.nn.Parameter(weight.to(getattr(weight_obj, weight_field).device), requires_grad=False))
+            else:
+                restore_weights_backup(obj, field, weight)
+
+
+def purge_merged_weights_cache():
+    global merged_weights_cache_size
+
+    limit = max(shared.opts.lora_merged_weights_cache_mb, 0) * 1024 * 1024
+    while merged_weights_cache_size > limit:
+        _, (_, evicted_size) = merged_weights_cache.popitem(last=False)
+        merged_weights_cache_size -= evicted_size
+
+
+def network_apply_weights_incrementally(self, current_names, wanted_names):
+    """
+    Changes weights of a layer that has the wanted networks applied with different multipliers by adding the difference
+    in contributions of networks whose multipliers changed, without restoring weights from backup and applying all networks
+    again. Returns False if that's not possible. After lora_incremental_updates such changes in a row, the layer is merged
+    from backup again so that rounding errors don't add up.
+    """
+
+    limit = shared.opts.lora_incremental_updates
+    if limit <= 0 or getattr(self, "network_incremental_updates", 0) >= limit:
+        return False
+
+    if len(current_names) != len(wanted_names) or any(c[0] != w[0] or c[3] != w[3] for c, w in zip(current_names, wanted_names)):
+        return False
+
+    # layers with fp8 weights are always calculated from fp16 copies; MHA and QKV layers have their own ways of applying networks
+    if isinstance(self, (torch.nn.MultiheadAttention, modules.models.sd3.mmdit.QkvLinear)) or getattr(self, 'fp16_weight', None) is not None:
+        return False
+
+    changes = []
+    for net, (_, te_multiplier, unet_multiplier, _) in zip(loaded_networks, current_names):
+        module = net.modules.get(self.network_layer_name, None)
+        if module is None:
+            continue
+
+        if module.updown_depends_on_weight():
+            return False
+
+        old_multiplier = module.multiplier_for(te_multiplier, unet_multiplier)
+        new_multiplier = module.multiplier()
+        if old_multiplier == new_multiplier:
+            continue
+
+        if new_multiplier == 0:
+            return False
+
+        # calc_updown returns a result for the new multiplier; this turns it into the difference from the old one
+        changes.append((module, (new_multiplier - old_multiplier) / new_multiplier))
+
+    try:
+        with torch.no_grad():
+            for module, ratio in changes:
+                updown, ex_bias = module.calc_updown(self.weight)
+
+                if len(self.weight.shape) == 4 and self.weight.shape[1] == 9:
+                    # inpainting model. zero pad updown to make channel[1]  4 to 9
+                    updown = torch.nn.functional.pad(updown, (0, 0, 0, 0, 0, 5))
+
+                self.weight.copy_((self.weight.to(dtype=updown.dtype) + updown * ratio).to(dtype=self.weight.dtype))
+                if ex_bias is not None and getattr(self, 'bias', None) is not None:
+                    self.bias.copy_((self.bias.to(dtype=ex_bias.dtype) + ex_bias * ratio).to(dtype=self.bias.dtype))
+    except RuntimeError as e:
+        logging.debug(f"Network layer {self.network_layer_name}: couldn't change multipliers incrementally: {e}")
+        return False
+
+    self.network_incremental_updates = getattr(self, "network_incremental_updates", 0) + 1
+
+    return True
+
+
 def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention]):
     """
     Applies the currently selected set of networks to the weights of torch layer self.
     If weights already have this particular set of networks applied, does nothing.
-    If not, restores original weights from backup and alters weights according to networks.
+    If not, restores original weights from backup and alters weights according to networks, or copies them from
+    merged weights cache if this set of networks has been applied to the layer recently. If only multipliers have
+    changed, only the difference is added to weights.
     """
 
     network_layer_name = getattr(self, 'network_layer_name', None)
@@ -451,6 +730,19 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
         self.network_bias_backup = bias_backup
 
     if current_names != wanted_names:
+        cache_key = merged_weights_cache_key(self, wanted_names)
+        merged = merged_weights_cache.get(cache_key) if cache_key is not None else None
+        if merged is not None:
+            merged_weights_cache.move_to_end(cache_key)
+            restore_merged_weights(self, merged[0])
+            self.network_current_names = wanted_names
+            self.network_incremental_updates = 0
+            return
+
+        if current_names != () and network_apply_weights_incrementally(self, current_names, wanted_names):
+            self.network_current_names = wanted_names
+            return
+
         network_restore_weights_from_backup(self)
 
         for net in loaded_networks:
@@ -540,12 +832,47 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
             extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
 
         self.network_current_names = wanted_names
+        self.network_incremental_updates = 0
+
+        if cache_key is not None:
+            store_merged_weights(self, cache_key)
+
+
+def batch_row_multipliers(module, items, y):
+    """
+    Returns a tensor with multiplier of module's network for each row of the batch, where items are indexes of images in
+    batch that rows belong to; None if the network is not used by any of those images.
+    """
+
+    key = (items, module.network.name, module.multiplier_for(0.0, 1.0), y.device, y.dtype)
+    if key in row_multipliers_cache:
+        return row_multipliers_cache[key]
+
+    values = []
+    for item in items:
+        multipliers = batch_item_multipliers[item] if item < len(batch_item_multipliers) else {}
+        values.append(module.multiplier_for(*multipliers.get(module.network.name, (0.0, 0.0))))
+
+    res = torch.tensor(values, device=y.device, dtype=y.dtype) if any(values) else None
+    row_multipliers_cache[key] = res
+
+    return res
+
+
+def set_batch_item_multipliers(multipliers):
+    """Sets (te multiplier, unet multiplier) of every network for each image in batch, as a list of dicts; None to use the same networks for all images."""
+
+    global batch_item_multipliers
+
+    batch_item_multipliers = multipliers
+    row_multipliers_cache.clear()
 
 
 def network_forward(org_module, input, original_forward):
     """
     Old way of applying Lora by executing operations during layer's forward.
     Stacking many loras this way results in big performance degradation.
+    With lora_runtime, this is also how each image in batch gets its own networks.
     """
 
     if len(loaded_networks) == 0:
@@ -558,13 +885,30 @@ def network_forward(org_module, input, original_forward):
 
     y = original_forward(org_module, input)
 
+    # batch_items is only set for the diffusion model; text encoder uses the same networks for all prompts
+    items = sd_samplers_cfg_denoiser.batch_items if batch_item_multipliers is not None else None
+    if items is not None and len(items) != y.shape[0]:
+        items = None
+
     network_layer_name = getattr(org_module, 'network_layer_name', None)
     for lora in loaded_networks:
         module = lora.modules.get(network_layer_name, None)
         if module is None:
             continue
 
-        y = module.forward(input, y)
+        if not module.supports_forward():
+            logging.debug(f"Network {lora.name} layer {network_layer_name}: couldn't find supported operation")
+            extra_network_lora.errors[lora.name] = extra_network_lora.errors.get(lora.name, 0) + 1
+            continue
+
+        if items is None:
+            if module.multiplier() != 0:
+                y = module.forward(input, y)
+            continue
+
+        multipliers = batch_row_multipliers(module, items, y)
+        if multipliers is not None:
+            y = module.forward_per_sample(input, y, multipliers)
 
     return y
 
@@ -573,10 +917,11 @@ def network_reset_cached_weight(self: Union[torch.nn.Conv2d, torch.nn.Linear]):
     self.network_current_names = ()
     self.network_weights_backup = None
     self.network_bias_backup = None
+    self.network_merged_weights_id = None
 
 
 def network_Linear_forward(self, input):
-    if shared.opts.lora_functional:
+    if shared.opts.lora_functional or shared.opts.lora_runtime:
         return network_forward(self, input, originals.Linear_forward)
 
     network_apply_weights(self)
@@ -585,13 +930,14 @@ def network_Linear_forward(self, input):
 
 
 def network_Linear_load_state_dict(self, *args, **kwargs):
+    network_restore_weights_from_backup(self)
     network_reset_cached_weight(self)
 
     return originals.Linear_load_state_dict(self, *args, **kwargs)
 
 
 def network_Conv2d_forward(self, input):
-    if shared.opts.lora_functional:
+    if shared.opts.lora_functional or shared.opts.lora_runtime:
         return network_forward(self, input, originals.Conv2d_forward)
 
     network_apply_weights(self)
@@ -600,13 +946,14 @@ def network_Conv2d_forward(self, input):
 
 
 def network_Conv2d_load_state_dict(self, *args, **kwargs):
+    network_restore_weights_from_backup(self)
     network_reset_cached_weight(self)
 
     return originals.Conv2d_load_state_dict(self, *args, **kwargs)
 
 
 def network_GroupNorm_forward(self, input):
-    if shared.opts.lora_functional:
+    if shared.opts.lora_functional or shared.opts.lora_runtime:
         return network_forward(self, input, originals.GroupNorm_forward)
 
     network_apply_weights(self)
@@ -615,13 +962,14 @@ def network_GroupNorm_forward(self, input):
 
 
 def network_GroupNorm_load_state_dict(self, *args, **kwargs):
+    network_restore_weights_from_backup(self)
     network_reset_cached_weight(self)
 
     return originals.GroupNorm_load_state_dict(self, *args, **kwargs)
 
 
 def network_LayerNorm_forward(self, input):
-    if shared.opts.lora_functional:
+    if shared.opts.lora_functional or shared.opts.lora_runtime:
         return network_forward(self, input, originals.LayerNorm_forward)
 
     network_apply_weights(self)
@@ -630,6 +978,7 @@ def network_LayerNorm_forward(self, input):
 
 
 def network_LayerNorm_load_state_dict(self, *args, **kwargs):
+    network_restore_weights_from_backup(self)
     network_reset_cached_weight(self)
 
     return originals.LayerNorm_load_state_dict(self, *args, **kwargs)
@@ -732,35 +1081,136 @@ def network_MultiheadAttention_forward(self, *args, **kwargs):
 
 
 def network_MultiheadAttention_load_state_dict(self, *args, **kwargs):
+    network_restore_weights_from_backup(self)
     network_reset_cached_weight(self)
 
     return originals.MultiheadAttention_load_state_dict(self, *args, **kwargs)
 
 
 def process_network_files(names: list[str] | None = None):
+    # when looking for a few names, only files with those names are statted
+    if names:
+        process_network_file_candidates(names)
+        return
+
+    with cache.stat_directories(shared.cmd_opts.lora_dir, shared.cmd_opts.lyco_dir_backcompat):
+        process_network_file_candidates(names)
+
+
+def load_network_index():
+    """Returns persistent index of network files: a dict of filename -> dict with version, stat key, name and NetworkOnDisk.index_entry()."""
+
+    global network_index
+
+    if network_index is None:
+        try:
+            network_index = cache.cache("lora-index").get("networks") or {}
+        except Exception:
+            errors.report("Failed to read Lora index", exc_info=True)
+            network_index = {}
+
+    return network_index
+
+
+def save_network_index(index):
+    global network_index
+
+    if index == network_index:
+        return
+
+    network_index = index
+    try:
+        cache.cache("lora-index")["networks"] = index
+    except Exception:
+        errors.report("Failed to write Lora index", exc_info=True)
+
+
+def read_network_on_disk(name, filename, file_stat):
+    try:
+        # this runs on a worker thread, which does not see stats gathered by cache.stat_directories() on the calling one
+        with cache.known_file_stats({filename: file_stat}):
+            return network.NetworkOnDisk(name, filename)
+    except OSError:  # should catch FileNotFoundError and PermissionError etc.
+        errors.report(f"Failed to load network {name} from {filename}", exc_info=True)
+        return None
+
+
+def process_network_file_candidates(names: list[str] | None = None):
+    """
+    Finds network files and adds them to available networks. Files that have not changed since the last time are not
+    read again: objects from the previous call are reused, or recreated from the persistent index after restart. Other
+    files are read in parallel.
+    """
+
     candidates = list(shared.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
     candidates += list(shared.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
+
+    index = load_network_index()
+
+    found = []
+    entries = {}
+    to_read = []
     for filename in candidates:
-        if os.path.isdir(filename):
-            continue
         name = os.path.splitext(os.path.basename(filename))[0]
         # if names is provided, only load networks with names in the list
         if names and name not in names:
             continue
+
         try:
-            entry = network.NetworkOnDisk(name, filename)
-        except OSError:  # should catch FileNotFoundError and PermissionError etc.
+            file_stat = cache.file_stat(filename)
+        except OSError:
             errors.report(f"Failed to load network {name} from {filename}", exc_info=True)
             continue
 
+        if stat.S_ISDIR(file_stat.st_mode):
+            continue
+
+        key = hashes.stat_key(file_stat)
+        found.append((name, filename, key))
+
+        known_key, known_entry = network_files.get(filename, (None, None))
+        index_entry = index.get(filename)
+        if known_key == key and known_entry.name == name:
+            entries[filename] = known_entry
+        elif index_entry is not None and index_entry.get("version") == network_index_version and index_entry["stat"] == key and index_entry["name"] == name:
+            entries[filename] = network.NetworkOnDisk(name, filename, index_entry)
+        else:
+            to_read.append((name, filename, file_stat))
+
+    if to_read:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            for (_, filename, _), entry in zip(to_read, executor.map(lambda x: read_network_on_disk(*x), to_read)):
+                if entry is not None:
+                    entries[filename] = entry
+
+    if not names:
+        network_files.clear()
+
+    for name, filename, key in found:
+        entry = entries.get(filename)
+        if entry is None:
+            continue
+
+        network_files[filename] = (key, entry)
+
         available_networks[name] = entry
 
+        if entry.shorthash:
+            available_network_hash_lookup[entry.shorthash] = entry
+
         if entry.alias in available_network_aliases:
             forbidden_network_aliases[entry.alias.lower()] = 1
 
         available_network_aliases[name] = entry
         available_network_aliases[entry.alias] = entry
 
+        if not entry.hash:
+            hashing_service.service.submit(filename, "lora/" + name, use_addnet_hash=entry.is_safetensors, callback=entry.set_hash)
+
+    new_index = {} if not names else {k: v for k, v in index.items() if os.path.splitext(os.path.basename(k))[0] not in names}
+    new_index.update({filename: {"version": network_index_version, "stat": key, "name": entry.name, **entry.index_entry()} for filename, (key, entry) in network_files.items()})
+    save_network_index(new_index)
+
 
 def update_available_networks_by_names(names: list[str]):
     process_network_files(names)
@@ -820,7 +1270,15 @@ available_networks = {}
 available_network_aliases = {}
 loaded_networks = []
 loaded_bundle_embeddings = {}
+batch_item_multipliers = None
+row_multipliers_cache = {}
 networks_in_memory = {}
+networks_demoted = {}
+network_files = {}
+network_index = None
+merged_weights_cache = OrderedDict()
+merged_weights_cache_size = 0
+merged_weights_ids = itertools.count()
 available_network_hash_lookup = {}
 forbidden_network_aliases = {}
 
@@ -40,6 +40,12 @@ shared.options_templates.update(shared.options_section(('extra_networks', "Extra
     "lora_show_all": shared.OptionInfo(False, "Always show all networks on the Lora page").info("otherwise, those detected as for incompatible version of Stable Diffusion will be hidden"),
     "lora_hide_unknown_for_versions": shared.OptionInfo([], "Hide networks of unknown versions for model versions", gr.CheckboxGroup, {"choices": ["SD1", "SD2", "SDXL"]}),
     "lora_in_memory_limit": shared.OptionInfo(0, "Number of Lora networks to keep cached in memory", gr.Number, {"precision": 0}),
+    "lora_in_memory_limit_mb": shared.OptionInfo(0, "Memory for Lora networks kept cached in RAM (MB)", gr.Number, {"precision": 0}).info("0 = use the number of networks above; otherwise, least recently used networks are evicted when their total size exceeds this"),
+    "lora_in_memory_pinned": shared.OptionInfo("", "Lora networks that are never evicted from cache").info("comma-separated names"),
+    "lora_in_memory_mapped_limit": shared.OptionInfo(0, "Number of evicted Lora networks to keep memory-mapped from disk", gr.Number, {"precision": 0}).info("0 = disable; .safetensors networks evicted from cache are memory-mapped from their files when used again, so their weights stay in OS file cache, which OS can free, instead of in RAM"),
+    "lora_incremental_updates": shared.OptionInfo(0, "When only Lora multipliers change, update weights incrementally this many times before applying networks from scratch", gr.Number, {"precision": 0}).info("0 = disable; changing a multiplier adds the difference to weights instead of restoring them and applying all networks again; results may differ slightly from a full apply"),
+    "lora_runtime": shared.OptionInfo(False, "Apply Lora networks during generation without changing model weights").info("each image in a batch can use its own networks, so that requests with different networks can be processed together; slower than applying networks to weights when they are the same for whole batch; text encoder always uses networks of the first prompt in batch"),
+    "lora_merged_weights_cache_mb": shared.OptionInfo(0, "Memory for weights with Lora networks applied to keep in RAM (MB)", gr.Number, {"precision": 0}).info("0 = disable; going back to a recently used combination of networks and multipliers copies layer weights from RAM instead of applying networks again"),
     "lora_not_found_warning_console": shared.OptionInfo(False, "Lora not found warning in console"),
     "lora_not_found_gradio_warning": shared.OptionInfo(False, "Lora not found warning popup in webui"),
 }))
@@ -100,3 +106,7 @@ def infotext_pasted(infotext, d):
 script_callbacks.on_infotext_pasted(infotext_pasted)
 
 shared.opts.onchange("lora_in_memory_limit", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_in_memory_limit_mb", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_in_memory_pinned", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_in_memory_mapped_limit", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_merged_weights_cache_mb", networks.purge_merged_weights_cache)
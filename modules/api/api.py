@@ -1,5 +1,6 @@
 import base64
 import io
+import json
 import os
 import time
 import datetime
@@ -17,10 +18,10 @@ from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, queue_scheduler, image_encoding, sd_models_prefetch, hashing_service, extra_networks
+from modules.api import models, jobs, coalesce, streaming, result_cache
 from modules.shared import opts
-from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
+from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images, get_fixed_seed
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
 from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypernetwork
 from PIL import PngImagePlugin
@@ -30,8 +31,9 @@ from modules import devices
 from typing import Any
 import piexif
 import piexif.helper
-from contextlib import closing
+from contextlib import closing, contextmanager
 from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
+import modules.progress
 
 def script_name_to_index(name, scripts):
     try:
@@ -99,10 +101,20 @@ def decode_base64_to_image(encoding):
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
+def image_content_type():
+    samples_format = opts.samples_format.lower()
+    return "image/jpeg" if samples_format == "jpg" else f"image/{samples_format}"
+
+
 def encode_pil_to_base64(image):
+    if isinstance(image, str):
+        return image
+
+    return base64.b64encode(encode_pil_to_bytes(image))
+
+
+def encode_pil_to_bytes(image):
     with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
         if opts.samples_format.lower() == 'png':
             use_metadata = False
             metadata = PngImagePlugin.PngInfo()
@@ -129,10 +141,29 @@ def encode_pil_to_base64(image):
 
         bytes_data = output_bytes.getvalue()
 
-    return base64.b64encode(bytes_data)
+    return bytes_data
+
+
+def api_client_name(req: Request, credentials=None):
+    """Name of the client used for fair-share queueing: the basic auth username if it matches credentials, otherwise client's address.
+
+    This runs before the auth dependency checks the request, so the username is only used after its password is verified here.
+    """
+
+    authorization = req.headers.get("authorization", "")
+    if credentials and authorization.lower().startswith("basic "):
+        try:
+            username, password = base64.b64decode(authorization[6:]).decode("utf8").split(":", 1)
+        except Exception:
+            username, password = None, None
+
+        if username in credentials and compare_digest(password.encode("utf8"), credentials[username].encode("utf8")):
+            return username
+
+    return req.scope.get('client', ('0:0.0.0', 0))[0]
 
 
-def api_middleware(app: FastAPI):
+def api_middleware(app: FastAPI, credentials=None):
     rich_available = False
     try:
         if os.environ.get('WEBUI_RICH_EXCEPTIONS', None) is not None:
@@ -164,6 +195,14 @@ def api_middleware(app: FastAPI):
             ))
         return res
 
+    @app.middleware("http")
+    async def queue_context(req: Request, call_next):
+        if not req.scope.get('path', 'err').startswith('/sdapi'):
+            return await call_next(req)
+
+        with queue_scheduler.request_context(priority=queue_scheduler.PRIORITY_BULK, client=api_client_name(req, credentials)):
+            return await call_next(req)
+
     def handle_exception(request: Request, e: Exception):
         err = {
             "error": type(e).__name__,
@@ -171,6 +210,8 @@ def api_middleware(app: FastAPI):
             "body": vars(e).get('body', ''),
             "errors": str(e),
         }
+        if isinstance(e, queue_scheduler.QueueFullError):
+            return JSONResponse(status_code=429, content=jsonable_encoder(err), headers={"Retry-After": str(e.retry_after)})
         if not isinstance(e, HTTPException):  # do not print backtrace on known httpexceptions
             message = f"API error: {request.method}: {request.url} {err}"
             if rich_available:
@@ -207,9 +248,14 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
-        api_middleware(self.app)
+        api_middleware(self.app, credentials=getattr(self, "credentials", None))
         self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
         self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v1/jobs/txt2img", self.submit_text2img_job, methods=["POST"], response_model=models.JobSubmitResponse)
+        self.add_api_route("/sdapi/v1/jobs/img2img", self.submit_img2img_job, methods=["POST"], response_model=models.JobSubmitResponse)
+        self.add_api_route("/sdapi/v1/jobs/{job_id}", self.get_job_status, methods=["GET"], response_model=models.JobStatusResponse)
+        self.add_api_route("/sdapi/v1/jobs/{job_id}/result", self.get_job_result, methods=["GET"])
+        self.add_api_route("/sdapi/v1/jobs/{job_id}/cancel", self.cancel_job, methods=["POST"], response_model=models.JobStatusResponse)
         self.add_api_route("/sdapi/v1/extra-single-image", self.extras_single_image_api, methods=["POST"], response_model=models.ExtrasSingleImageResponse)
         self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
         self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
@@ -239,6 +285,9 @@ class Api:
         self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/train/hypernetwork", self.train_hypernetwork, methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
+        self.add_api_route("/sdapi/v1/cond-cache", self.get_cond_cache, methods=["GET"], response_model=models.CondCacheResponse)
+        self.add_api_route("/sdapi/v1/result-cache", self.get_result_cache, methods=["GET"], response_model=models.ResultCacheResponse)
+        self.add_api_route("/sdapi/v1/hashing", self.get_hashing_status, methods=["GET"], response_model=models.HashingStatusResponse)
         self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
@@ -269,6 +318,14 @@ class Api:
         if not self.default_script_arg_img2img:
             self.default_script_arg_img2img = self.init_default_script_args(img2img_script_runner)
 
+        self.coalescer = coalesce.RequestCoalescer(max_batch_size=lambda: opts.api_coalesce_max_batch_size)
+
+        self.jobs = jobs.get_runner()
+        self.jobs.handlers = {
+            "txt2img": self.run_text2img_job,
+            "img2img": self.run_img2img_job,
+        }
+        self.jobs.start()
 
 
     def add_api_route(self, path: str, endpoint, **kwargs):
@@ -283,6 +340,22 @@ class Api:
 
         raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
 
+    @contextmanager
+    def queue_lock_for_task(self, task_id):
+        """Holds queue lock for a task added with add_task_to_queue; removes the task from pending list if the queue rejects it."""
+
+        try:
+            with queue_scheduler.request_context(id_task=task_id):
+                self.queue_lock.acquire()
+        except queue_scheduler.QueueFullError:
+            modules.progress.pending_tasks.pop(task_id, None)
+            raise
+
+        try:
+            yield
+        finally:
+            self.queue_lock.release()
+
     def get_selectable_script(self, script_name, script_runner):
         if script_name is None or script_name == "":
             return None, None
@@ -430,6 +503,15 @@ class Api:
         return params
 
     def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+        if txt2imgreq.response_format == "multipart":
+            stream = streaming.MultipartImageStream(encode_pil_to_bytes, image_content_type())
+            return stream.run(lambda image_callback: self.text2img(txt2imgreq, image_callback=image_callback))
+
+        return self.text2img(txt2imgreq)
+
+    def text2img(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, image_callback=None):
+        """Does the work of text2imgapi; if image_callback is set, images are passed to it as they are generated instead of being included in the response."""
+
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
 
         script_runner = scripts.scripts_txt2img
@@ -437,6 +519,15 @@ class Api:
         infotext_script_args = {}
         self.apply_infotext(txt2imgreq, "txt2img", script_runner=script_runner, mentioned_script_args=infotext_script_args)
 
+        cache_key = None
+        if image_callback is None and result_cache.cacheable(txt2imgreq):
+            cache_key = result_cache.key("txt2img", txt2imgreq)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                # the task never enters the queue; it's marked as finished so that progress of force_task_id shows it
+                finish_task(task_id)
+                return models.TextToImageResponse(images=cached[0], parameters=vars(txt2imgreq), info=cached[1])
+
         selectable_scripts, selectable_script_idx = self.get_selectable_script(txt2imgreq.script_name, script_runner)
         sampler, scheduler = sd_samplers.get_sampler_and_scheduler(txt2imgreq.sampler_name or txt2imgreq.sampler_index, txt2imgreq.scheduler)
 
@@ -456,24 +547,48 @@ class Api:
         args.pop('script_args', None) # will refeed them to the pipeline directly after initializing them
         args.pop('alwayson_scripts', None)
         args.pop('infotext', None)
+        args.pop('response_format', None)
 
         script_args = self.init_script_args(txt2imgreq, self.default_script_arg_txt2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        if not send_images:
+            image_callback = None
+
         add_task_to_queue(task_id)
+        self.prepare_for_task(task_id, args)
 
-        with self.queue_lock:
+        if self.coalescer.enabled() and image_callback is None and selectable_scripts is None and not txt2imgreq.alwayson_scripts and not infotext_script_args and args.get('batch_size') == 1 and args.get('n_iter') == 1 and isinstance(args.get('prompt'), str):
+            request = coalesce.CoalescedRequest(task_id, args, self.queue_lock_for_task(task_id))
+            # with lora_runtime, each image in batch gets Lora networks that do not change the text encoder from its own prompt
+            extra_network_lora = extra_networks.extra_network_registry.get("lora")
+            per_item_extra_networks = {"lora": extra_network_lora.per_item_params} if getattr(opts, "lora_runtime", False) and hasattr(extra_network_lora, "per_item_params") else {}
+            try:
+                images_list, info = self.coalescer.run(coalesce.coalescing_key(args, per_item_extra_networks), request, lambda requests: self.text2img_batch(requests, script_args))
+            finally:
+                modules.progress.pending_tasks.pop(task_id, None)
+
+            b64images = image_encoding.map(encode_pil_to_base64, images_list) if send_images else []
+
+            if cache_key is not None:
+                result_cache.put(cache_key, b64images, info)
+
+            return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=info)
+
+        with self.queue_lock_for_task(task_id):
             with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
                 p.is_api = True
                 p.scripts = script_runner
                 p.outpath_grids = opts.outdir_txt2img_grids
                 p.outpath_samples = opts.outdir_txt2img_samples
+                p.image_callback = image_callback
 
                 try:
                     shared.state.begin(job="scripts_txt2img")
                     start_task(task_id)
+                    self.jobs.task_started(task_id)
                     if selectable_scripts is not None:
                         p.script_args = script_args
                         processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
@@ -485,11 +600,97 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        if image_callback is not None:
+            for image in processed.images:
+                image_callback(image)
+
+            b64images = []
+        else:
+            b64images = image_encoding.map(encode_pil_to_base64, processed.images) if send_images else []
+
+        info = processed.js()
+        if cache_key is not None:
+            result_cache.put(cache_key, b64images, info)
+
+        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=info)
+
+    def text2img_batch(self, requests, script_args):
+        """Processes coalesced txt2img requests as one batch; returns a tuple of images and info for each request."""
+
+        cancelled = {request.task_id for request in requests if self.jobs.task_cancelled(request.task_id)}
+        if cancelled and len(cancelled) < len(requests):
+            # a job cancelled while waiting is left out rather than interrupting the batch for everyone else
+            kept = [request for request in requests if request.task_id not in cancelled]
+            results = dict(zip([request.task_id for request in kept], self.text2img_batch(kept, script_args)))
+            for id_task in cancelled:
+                finish_task(id_task)
+
+            return [results.get(request.task_id, ([], json.dumps({}))) for request in requests]
+
+        args = dict(requests[0].args)
+        args.update({
+            "prompt": [request.args['prompt'] for request in requests],
+            "negative_prompt": [request.args['negative_prompt'] for request in requests],
+            "seed": [get_fixed_seed(request.args['seed']) for request in requests],
+            "subseed": [get_fixed_seed(request.args['subseed']) for request in requests],
+            "batch_size": len(requests),
+        })
+
+        with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
+            p.is_api = True
+            p.scripts = scripts.scripts_txt2img
+            p.outpath_grids = opts.outdir_txt2img_grids
+            p.outpath_samples = opts.outdir_txt2img_samples
+            p.do_not_save_grid = True
+            p.script_args = tuple(script_args)
+
+            try:
+                shared.state.begin(job="scripts_txt2img")
+                for request in reversed(requests):
+                    start_task(request.task_id)
+                for request in requests:
+                    self.jobs.task_started(request.task_id)
+                processed = process_images(p)
+                for request in requests:
+                    finish_task(request.task_id)
+            finally:
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+        info = json.loads(processed.js())
+        first = processed.index_of_first_image
+
+        res = []
+        for i, request in enumerate(requests):
+            item_info = {
+                **info,
+                "prompt": processed.all_prompts[i],
+                "all_prompts": processed.all_prompts[i:i + 1],
+                "negative_prompt": processed.all_negative_prompts[i],
+                "all_negative_prompts": processed.all_negative_prompts[i:i + 1],
+                "seed": processed.all_seeds[i],
+                "all_seeds": processed.all_seeds[i:i + 1],
+                "subseed": processed.all_subseeds[i],
+                "all_subseeds": processed.all_subseeds[i:i + 1],
+                "batch_size": 1,
+                "index_of_first_image": 0,
+                "infotexts": processed.infotexts[first + i:first + i + 1],
+            }
 
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+            res.append((processed.images[first + i:first + i + 1], json.dumps(item_info)))
+
+        return res
 
     def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        if img2imgreq.response_format == "multipart":
+            stream = streaming.MultipartImageStream(encode_pil_to_bytes, image_content_type())
+            return stream.run(lambda image_callback: self.img2img(img2imgreq, image_callback=image_callback))
+
+        return self.img2img(img2imgreq)
+
+    def img2img(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, image_callback=None):
+        """Does the work of img2imgapi; if image_callback is set, images are passed to it as they are generated instead of being included in the response."""
+
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
         init_images = img2imgreq.init_images
@@ -505,6 +706,18 @@ class Api:
         infotext_script_args = {}
         self.apply_infotext(img2imgreq, "img2img", script_runner=script_runner, mentioned_script_args=infotext_script_args)
 
+        cache_key = None
+        if image_callback is None and result_cache.cacheable(img2imgreq):
+            cache_key = result_cache.key("img2img", img2imgreq)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                finish_task(task_id)
+                if not img2imgreq.include_init_images:
+                    img2imgreq.init_images = None
+                    img2imgreq.mask = None
+
+                return models.ImageToImageResponse(images=cached[0], parameters=vars(img2imgreq), info=cached[1])
+
         selectable_scripts, selectable_script_idx = self.get_selectable_script(img2imgreq.script_name, script_runner)
         sampler, scheduler = sd_samplers.get_sampler_and_scheduler(img2imgreq.sampler_name or img2imgreq.sampler_index, img2imgreq.scheduler)
 
@@ -526,25 +739,32 @@ class Api:
         args.pop('script_args', None)  # will refeed them to the pipeline directly after initializing them
         args.pop('alwayson_scripts', None)
         args.pop('infotext', None)
+        args.pop('response_format', None)
 
         script_args = self.init_script_args(img2imgreq, self.default_script_arg_img2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        if not send_images:
+            image_callback = None
+
         add_task_to_queue(task_id)
+        self.prepare_for_task(task_id, args)
 
-        with self.queue_lock:
+        with self.queue_lock_for_task(task_id):
             with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
                 p.init_images = [decode_base64_to_image(x) for x in init_images]
                 p.is_api = True
                 p.scripts = script_runner
                 p.outpath_grids = opts.outdir_img2img_grids
                 p.outpath_samples = opts.outdir_img2img_samples
+                p.image_callback = image_callback
 
                 try:
                     shared.state.begin(job="scripts_img2img")
                     start_task(task_id)
+                    self.jobs.task_started(task_id)
                     if selectable_scripts is not None:
                         p.script_args = script_args
                         processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
@@ -556,13 +776,111 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        if image_callback is not None:
+            for image in processed.images:
+                image_callback(image)
+
+            b64images = []
+        else:
+            b64images = image_encoding.map(encode_pil_to_base64, processed.images) if send_images else []
+
+        info = processed.js()
+        if cache_key is not None:
+            result_cache.put(cache_key, b64images, info)
 
         if not img2imgreq.include_init_images:
             img2imgreq.init_images = None
             img2imgreq.mask = None
 
-        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=info)
+
+    def prepare_for_task(self, task_id, args):
+        """Starts loading files a queued task is going to need: prefetches its checkpoint and moves it to the front of the hashing queue."""
+
+        checkpoint_name = (args.get('override_settings') or {}).get('sd_model_checkpoint')
+        sd_models_prefetch.note_task(task_id, checkpoint_name)
+
+        checkpoint_info = sd_models.get_closet_checkpoint_match(checkpoint_name) if checkpoint_name else None
+        if checkpoint_info is not None:
+            hashing_service.service.submit(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}", priority=hashing_service.PRIORITY_NEEDED)
+
+    def check_jobs_queue_depth(self):
+        limit = opts.api_queue_max_depth
+        queued = self.jobs.store.queued_count()
+        if limit and queued >= limit:
+            raise queue_scheduler.QueueFullError(self.queue_lock.retry_after(queued))
+
+    def submit_text2img_job(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+        self.check_jobs_queue_depth()
+        job_id = self.jobs.submit("txt2img", vars(txt2imgreq), client=queue_scheduler.current_client.get())
+        return models.JobSubmitResponse(id=job_id, task_id=jobs.task_id(job_id), status=jobs.STATUS_QUEUED)
+
+    def submit_img2img_job(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        if img2imgreq.init_images is None:
+            raise HTTPException(status_code=404, detail="Init image not found")
+
+        self.check_jobs_queue_depth()
+        job_id = self.jobs.submit("img2img", vars(img2imgreq), client=queue_scheduler.current_client.get())
+        return models.JobSubmitResponse(id=job_id, task_id=jobs.task_id(job_id), status=jobs.STATUS_QUEUED)
+
+    def run_text2img_job(self, request, task_id):
+        txt2imgreq = models.StableDiffusionTxt2ImgProcessingAPI(**request)
+        txt2imgreq.force_task_id = task_id
+        return jsonable_encoder(self.text2img(txt2imgreq))
+
+    def run_img2img_job(self, request, task_id):
+        img2imgreq = models.StableDiffusionImg2ImgProcessingAPI(**request)
+        img2imgreq.force_task_id = task_id
+        return jsonable_encoder(self.img2img(img2imgreq))
+
+    def get_job(self, job_id):
+        job = self.jobs.store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        return job
+
+    def get_job_status(self, job_id: str):
+        job = self.get_job(job_id)
+
+        res = models.JobStatusResponse(
+            id=job["id"],
+            type=job["type"],
+            status=job["status"],
+            error=job["error"],
+            created=job["created"],
+            started=job["started"],
+            finished=job["finished"],
+            expires=job["expires"],
+        )
+
+        if job["status"] == jobs.STATUS_QUEUED:
+            res.queue_position = self.jobs.store.queue_position(job_id)
+        elif job["status"] == jobs.STATUS_RUNNING:
+            progress = modules.progress.progressapi(modules.progress.ProgressRequest(id_task=jobs.task_id(job_id), live_preview=False))
+            res.progress = progress.progress
+            res.eta = progress.eta
+
+        return res
+
+    def get_job_result(self, job_id: str):
+        job = self.get_job(job_id)
+
+        if job["status"] == jobs.STATUS_FAILED:
+            raise HTTPException(status_code=500, detail=job["error"])
+
+        if job["result"] is None:
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+        return Response(content=job["result"], media_type="application/json")
+
+    def cancel_job(self, job_id: str):
+        self.get_job(job_id)
+
+        if not self.jobs.cancel(job_id):
+            raise HTTPException(status_code=409, detail="Job has already finished")
+
+        return self.get_job_status(job_id)
 
     def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
         reqDict = setUpscalers(req)
@@ -583,7 +901,7 @@ class Api:
         with self.queue_lock:
             result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, **reqDict)
 
-        return models.ExtrasBatchImagesResponse(images=list(map(encode_pil_to_base64, result[0])), html_info=result[1])
+        return models.ExtrasBatchImagesResponse(images=image_encoding.map(encode_pil_to_base64, result[0]), html_info=result[1])
 
     def pnginfoapi(self, req: models.PNGInfoRequest):
         image = decode_base64_to_image(req.image.strip())
@@ -677,7 +995,10 @@ class Api:
 
     def set_config(self, req: dict[str, Any]):
         checkpoint_name = req.get("sd_model_checkpoint", None)
-        if checkpoint_name is not None and checkpoint_name not in sd_models.checkpoint_aliases:
+        with sd_models.checkpoints_lock:
+            checkpoint_found = checkpoint_name is None or checkpoint_name in sd_models.checkpoint_aliases
+
+        if not checkpoint_found:
             raise RuntimeError(f"model {checkpoint_name!r} not found")
 
         for k, v in req.items():
@@ -725,7 +1046,10 @@ class Api:
 
     def get_sd_models(self):
         import modules.sd_models as sd_models
-        return [{"title": x.title, "model_name": x.model_name, "hash": x.shorthash, "sha256": x.sha256, "filename": x.filename, "config": find_checkpoint_config_near_filename(x)} for x in sd_models.checkpoints_list.values()]
+        with sd_models.checkpoints_lock:
+            checkpoints = list(sd_models.checkpoints_list.values())
+
+        return [{"title": x.title, "model_name": x.model_name, "hash": x.shorthash, "sha256": x.sha256, "filename": x.filename, "config": find_checkpoint_config_near_filename(x), "architecture": x.architecture} for x in checkpoints]
 
     def get_sd_vaes(self):
         import modules.sd_vae as sd_vae
@@ -883,6 +1207,17 @@ class Api:
             cuda = {'error': f'{err}'}
         return models.MemoryResponse(ram=ram, cuda=cuda)
 
+    def get_cond_cache(self):
+        from modules import cond_cache, sd_hijack_clip
+
+        return models.CondCacheResponse(conds=cond_cache.cache.stats(), text_encoder_chunks=sd_hijack_clip.chunk_cache.stats())
+
+    def get_result_cache(self):
+        return models.ResultCacheResponse(stats=result_cache.stats())
+
+    def get_hashing_status(self):
+        return models.HashingStatusResponse(**hashing_service.service.status())
+
     def get_extensions_list(self):
         from modules import extensions
         extensions.list_extensions()
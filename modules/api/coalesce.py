@@ -0,0 +1,139 @@
+import contextlib
+import json
+import threading
+
+from modules import extra_networks
+
+# parameters that may differ between requests merged into one batch
+per_item_fields = ("prompt", "negative_prompt", "seed", "subseed", "force_task_id")
+
+
+class CoalescedRequest:
+    def __init__(self, task_id, args, queue_lock):
+        self.task_id = task_id
+        self.args = args
+        self.queue_lock = queue_lock
+        """context manager that gets this request a place in queue; used if the request ends up leading a batch"""
+
+        self.result = None
+        self.error = None
+        self.rejected = False
+        """set for followers of a batch whose leader was not admitted to the queue"""
+
+        self.done = threading.Event()
+
+
+class Batch:
+    def __init__(self, key):
+        self.key = key
+        self.requests = []
+
+
+class RequestCoalescer:
+    """Merges compatible requests that wait for the queue lock into one batch.
+
+    The first request for a key becomes the leader of a batch and waits for the queue lock; requests with the same
+    key that arrive while it waits join its batch instead of queueing on their own. Once the leader gets the lock,
+    the batch is closed and processed with a single call, and every request receives its own part of the result.
+    If the queue rejects the leader, each follower goes through the queue on its own instead.
+    """
+
+    def __init__(self, max_batch_size):
+        self.max_batch_size = max_batch_size
+        self.lock = threading.Lock()
+        self.open_batches = {}
+
+    def batch_limit(self):
+        limit = self.max_batch_size() if callable(self.max_batch_size) else self.max_batch_size
+        return limit or 1
+
+    def enabled(self):
+        return self.batch_limit() > 1
+
+    def run(self, key, request, process_batch):
+        """Runs request as part of a batch and returns its result.
+
+        The batch leader enters its request.queue_lock; process_batch is called with a list of CoalescedRequest
+        while holding it, and must return a list with a result for each of them.
+        """
+
+        with self.lock:
+            batch = self.open_batches.get(key)
+            is_leader = batch is None or len(batch.requests) >= self.batch_limit()
+            if is_leader:
+                batch = Batch(key)
+                self.open_batches[key] = batch
+
+            batch.requests.append(request)
+
+        if is_leader:
+            self.run_batch(batch, process_batch)
+        else:
+            request.done.wait()
+
+            if request.rejected:
+                batch = Batch(key)
+                batch.requests.append(request)
+                self.run_batch(batch, process_batch)
+
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def close_batch(self, batch):
+        with self.lock:
+            if self.open_batches.get(batch.key) is batch:
+                del self.open_batches[batch.key]
+
+    def run_batch(self, batch, process_batch):
+        leader = batch.requests[0]
+
+        try:
+            with contextlib.ExitStack() as stack:
+                try:
+                    stack.enter_context(leader.queue_lock)
+                except Exception as e:
+                    self.close_batch(batch)
+                    leader.error = e
+                    for request in batch.requests[1:]:
+                        request.rejected = True
+                    return
+
+                self.close_batch(batch)
+
+                results = process_batch(batch.requests)
+
+            for request, result in zip(batch.requests, results):
+                request.result = result
+        except Exception as e:
+            for request in batch.requests:
+                request.error = e
+
+            self.close_batch(batch)
+        finally:
+            for request in batch.requests:
+                request.done.set()
+
+
+def coalescing_key(args, per_item_extra_networks=None):
+    """
+    Returns a key that is equal for requests whose processing arguments differ only in per-item fields. Extra networks
+    in prompts are a part of the key, since all images in a batch get networks of the first prompt, except for those
+    allowed by per_item_extra_networks, which can be different for each image. per_item_extra_networks is a dict of
+    extra network name -> function that takes ExtraNetworkParams and tells whether they can be different for each image.
+    """
+
+    per_item_extra_networks = per_item_extra_networks or {}
+    shared_args = {k: v for k, v in args.items() if k not in per_item_fields}
+
+    for field in ("prompt", "negative_prompt"):
+        _, extra_network_data = extra_networks.parse_prompt(args.get(field) or "")
+        is_per_item = per_item_extra_networks if field == "prompt" else {}
+        shared_networks = {
+            name: [params.items for params in params_list if name not in is_per_item or not is_per_item[name](params)]
+            for name, params_list in sorted(extra_network_data.items())
+        }
+        shared_args[f"{field} extra networks"] = {name: items for name, items in shared_networks.items() if items}
+
+    return json.dumps(shared_args, sort_keys=True, default=str)
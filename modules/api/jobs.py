@@ -0,0 +1,291 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from modules import errors, shared, progress, queue_scheduler, sd_models_prefetch
+from modules.paths import data_path
+
+jobs_filename = os.environ.get('SD_WEBUI_JOBS_FILE', os.path.join(data_path, "api_jobs.sqlite"))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+finished_statuses = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class JobStore:
+    """A durable table of API jobs kept in an SQLite database.
+
+    Requests and results are stored as JSON text. Finished jobs get an expiry time and are removed by purge_expired().
+
+    Queued jobs are run round-robin between clients: the client that was served least recently goes first, and
+    each client's own jobs run in the order they were submitted.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                client TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                expires REAL
+            )
+        """)
+
+        columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "client" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN client TEXT NOT NULL DEFAULT ''")
+
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_client_started ON jobs (client, started)")
+
+        # jobs that were running when the server went down are put back into the queue
+        self.conn.execute("UPDATE jobs SET status=?, started=NULL WHERE status=?", (STATUS_QUEUED, STATUS_RUNNING))
+
+    def add(self, job_type, request, client=""):
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, type, client, status, request, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, client, STATUS_QUEUED, json.dumps(request), time.time()),
+            )
+
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+
+        if row is None or (row["expires"] is not None and row["expires"] < time.time()):
+            return None
+
+        return dict(row)
+
+    def queued_order(self, limit=None):
+        """Returns ids of queued jobs in the order they are going to be run. Must be called with self.lock held."""
+
+        jobs_by_client = collections.defaultdict(collections.deque)
+        for row in self.conn.execute("SELECT id, client FROM jobs WHERE status=? ORDER BY created", (STATUS_QUEUED,)):
+            jobs_by_client[row["client"]].append(row["id"])
+
+        if not jobs_by_client:
+            return []
+
+        placeholders = ", ".join("?" * len(jobs_by_client))
+        last_served = dict(self.conn.execute(f"SELECT client, MAX(started) FROM jobs WHERE started IS NOT NULL AND client IN ({placeholders}) GROUP BY client", list(jobs_by_client)).fetchall())
+
+        clients = collections.deque(sorted(jobs_by_client, key=lambda client: (client in last_served, last_served.get(client, 0))))
+
+        res = []
+        while clients and (limit is None or len(res) < limit):
+            client = clients.popleft()
+            jobs = jobs_by_client[client]
+            res.append(jobs.popleft())
+            if jobs:
+                clients.append(client)
+
+        return res
+
+    def queue_position(self, job_id):
+        """Returns 1-based position of a queued job, or None if the job is not waiting in queue."""
+
+        with self.lock:
+            order = self.queued_order()
+
+        if job_id not in order:
+            return None
+
+        return order.index(job_id) + 1
+
+    def queued_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status=?", (STATUS_QUEUED,)).fetchone()[0]
+
+    def queued_requests(self, limit):
+        """Returns requests of the oldest queued jobs, in the order they are going to be run."""
+
+        with self.lock:
+            order = self.queued_order(limit)
+            rows = [self.conn.execute("SELECT request FROM jobs WHERE id=?", (job_id,)).fetchone() for job_id in order]
+
+        return [json.loads(row["request"]) for row in rows if row is not None]
+
+    def take_next(self):
+        """Marks the next queued job as running and returns it; returns None if there are no queued jobs."""
+
+        with self.lock:
+            order = self.queued_order(limit=1)
+            if not order:
+                return None
+
+            row = self.conn.execute("SELECT * FROM jobs WHERE id=?", (order[0],)).fetchone()
+
+            self.conn.execute("UPDATE jobs SET status=?, started=? WHERE id=?", (STATUS_RUNNING, time.time(), row["id"]))
+
+        job = dict(row)
+        job["status"] = STATUS_RUNNING
+        return job
+
+    def finish(self, job_id, status, result=None, error=None, ttl=None):
+        now = time.time()
+        expires = now + ttl if ttl else None
+
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status=?, result=?, error=?, finished=?, expires=? WHERE id=?",
+                (status, json.dumps(result) if result is not None else None, error, now, expires, job_id),
+            )
+
+    def cancel(self, job_id, ttl=None):
+        """Cancels a job that has not started yet. Returns True if the job was cancelled."""
+
+        now = time.time()
+        expires = now + ttl if ttl else None
+
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status=?, finished=?, expires=? WHERE id=? AND status=?",
+                (STATUS_CANCELLED, now, expires, job_id, STATUS_QUEUED),
+            )
+
+        return cursor.rowcount > 0
+
+    def purge_expired(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires<?", (time.time(),))
+
+
+class JobRunner:
+    """Executes jobs from a JobStore one by one on a background thread.
+
+    handlers maps job type to a function that takes the stored request and the job's task id, and returns a JSON-serializable result.
+    """
+
+    def __init__(self, store, handlers):
+        self.store = store
+        self.handlers = handlers
+        self.wakeup = threading.Event()
+        self.cancel_requested = set()
+        self.running_job = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.run, daemon=True, name="API job runner")
+        self.thread.start()
+
+    def submit(self, job_type, request, client=""):
+        job_id = self.store.add(job_type, request, client)
+        self.wakeup.set()
+        sd_models_prefetch.prefetcher.notify()
+        return job_id
+
+    def cancel(self, job_id):
+        if self.store.cancel(job_id, ttl=shared.opts.api_jobs_result_ttl):
+            return True
+
+        if self.running_job == job_id:
+            self.cancel_requested.add(job_id)
+
+            # a job still waiting for the queue lock is interrupted by task_started() once it gets the lock
+            if progress.current_task == task_id(job_id):
+                shared.state.interrupt()
+
+            return True
+
+        return False
+
+    def task_cancelled(self, id_task):
+        """Whether the task belongs to the running job, and cancelling that job was requested."""
+
+        job_id = self.running_job
+        return job_id is not None and id_task == task_id(job_id) and job_id in self.cancel_requested
+
+    def task_started(self, id_task):
+        """Called after a task has got the queue lock and started; interrupts it right away if it is a job that was cancelled while waiting."""
+
+        if self.task_cancelled(id_task):
+            shared.state.interrupt()
+
+    def run(self):
+        while True:
+            self.store.purge_expired()
+
+            job = self.store.take_next()
+            if job is None:
+                self.wakeup.wait(timeout=60)
+                self.wakeup.clear()
+                continue
+
+            self.run_job(job)
+
+    def upcoming_checkpoints(self, limit=8):
+        """Returns names of checkpoints requested by queued jobs; used to prefetch them while other work runs."""
+
+        for request in self.store.queued_requests(limit):
+            name = (request.get("override_settings") or {}).get("sd_model_checkpoint")
+            if name:
+                yield name
+
+    def run_job(self, job):
+        job_id = job["id"]
+        self.running_job = job_id
+
+        try:
+            handler = self.handlers[job["type"]]
+            with queue_scheduler.request_context(priority=queue_scheduler.PRIORITY_BULK, client=job["client"] or "jobs"):
+                result = handler(json.loads(job["request"]), task_id(job_id))
+            status = STATUS_CANCELLED if job_id in self.cancel_requested else STATUS_DONE
+            self.store.finish(job_id, status, result=result, ttl=shared.opts.api_jobs_result_ttl)
+        except Exception as e:
+            errors.report(f"Error running API job {job_id}", exc_info=True)
+            self.store.finish(job_id, STATUS_FAILED, error=f"{type(e).__name__}: {e}", ttl=shared.opts.api_jobs_result_ttl)
+        finally:
+            self.cancel_requested.discard(job_id)
+            self.running_job = None
+
+
+runner = None
+runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Returns the process-wide job runner, creating its store on first use."""
+
+    global runner
+
+    with runner_lock:
+        if runner is None:
+            runner = JobRunner(JobStore(jobs_filename), {})
+            sd_models_prefetch.lookahead_sources.append(runner.upcoming_checkpoints)
+
+    return runner
+
+
+def task_id(job_id):
+    """Id of the progress task that corresponds to a job; usable with /internal/progress."""
+
+    return f"task(job-{job_id})"
@@ -109,6 +109,7 @@ StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "response_format", "type": Literal["json", "multipart"], "default": "json"},
     ]
 ).generate_model()
 
@@ -128,6 +129,7 @@ StableDiffusionImg2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "response_format", "type": Literal["json", "multipart"], "default": "json"},
     ]
 ).generate_model()
 
@@ -141,6 +143,24 @@ class ImageToImageResponse(BaseModel):
     parameters: dict
     info: str
 
+class JobSubmitResponse(BaseModel):
+    id: str = Field(title="Job ID", description="Use this id to query status and result of the job.")
+    task_id: str = Field(title="Task ID", description="id of the task that can be used with /internal/progress")
+    status: str = Field(title="Status", description="One of: queued, running, done, failed, cancelled.")
+
+class JobStatusResponse(BaseModel):
+    id: str = Field(title="Job ID")
+    type: str = Field(title="Type", description="Kind of the job, txt2img or img2img.")
+    status: str = Field(title="Status", description="One of: queued, running, done, failed, cancelled.")
+    queue_position: Optional[int] = Field(default=None, title="Queue position", description="1-based position among queued jobs; only set while the job is queued.")
+    progress: Optional[float] = Field(default=None, title="Progress", description="The progress with a range of 0 to 1; only set while the job is running.")
+    eta: Optional[float] = Field(default=None, title="ETA in secs")
+    error: Optional[str] = Field(default=None, title="Error", description="Error message for failed jobs.")
+    created: float = Field(title="Created", description="Unix timestamp of job submission.")
+    started: Optional[float] = Field(default=None, title="Started")
+    finished: Optional[float] = Field(default=None, title="Finished")
+    expires: Optional[float] = Field(default=None, title="Expires", description="Unix timestamp after which the result is discarded.")
+
 class ExtrasBaseRequest(BaseModel):
     resize_mode: Literal[0, 1] = Field(default=0, title="Resize Mode", description="Sets the resize mode: 0 to upscale by upscaling_resize amount, 1 to upscale up to upscaling_resize_h x upscaling_resize_w.")
     show_extras_results: bool = Field(default=True, title="Show results", description="Should the backend return the generated image?")
@@ -259,6 +279,7 @@ class SDModelItem(BaseModel):
     sha256: Optional[str] = Field(title="sha256 hash")
     filename: str = Field(title="Filename")
     config: Optional[str] = Field(title="Config file")
+    architecture: Optional[str] = Field(title="Architecture", description="Detected from the safetensors header without loading the model; null for .ckpt files")
 
 class SDVaeItem(BaseModel):
     model_name: str = Field(title="Model Name")
@@ -298,6 +319,22 @@ class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
 
+class CondCacheResponse(BaseModel):
+    conds: dict = Field(title="Conds", description="Stats of the cache for conds of whole prompts: entries, size and size_limit in bytes, hits, misses and hit_rate")
+    text_encoder_chunks: dict = Field(title="Text encoder chunks", description="Stats of the cache for text encoder outputs of prompt chunks, in the same format")
+
+class ResultCacheResponse(BaseModel):
+    stats: dict = Field(title="Stats", description="Stats of the cache for results of API requests: entries, size and size_limit in bytes, hits, misses and hit_rate")
+
+class HashingStatusResponse(BaseModel):
+    enabled: bool = Field(title="Enabled", description="Whether files are hashed in background")
+    queued: int = Field(title="Queued", description="Number of files waiting to be hashed")
+    queued_needed: int = Field(title="Queued needed", description="Number of waiting files that are needed by generation; those are hashed first")
+    hashed: int = Field(title="Hashed", description="Number of files hashed since startup")
+    failed: int = Field(title="Failed", description="Number of files that could not be hashed")
+    current: Optional[str] = Field(default=None, title="Current", description="File that is being hashed right now")
+    current_progress: Optional[float] = Field(default=None, title="Current progress", description="Progress of hashing the current file, from 0 to 1")
+
 
 class ScriptsList(BaseModel):
     txt2img: list = Field(default=None, title="Txt2img", description="Titles of scripts (txt2img)")
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+
+import diskcache
+
+from modules import cache, hashes, sd_models, sd_vae, shared
+
+# request fields that do not change generated images
+ignored_fields = ("force_task_id", "response_format")
+
+results = None
+results_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def get_cache():
+    """Returns the disk cache for API results, or None if it is disabled in settings."""
+
+    global results
+
+    size_limit = int(shared.opts.api_result_cache_size * 1024 * 1024)
+    if size_limit <= 0:
+        return None
+
+    with results_lock:
+        if results is None:
+            results = diskcache.Cache(os.path.join(cache.cache_dir, "api-results"), size_limit=size_limit, eviction_policy="least-recently-used")
+        elif results.size_limit != size_limit:
+            results.reset('size_limit', size_limit)
+
+    return results
+
+
+def cacheable(req):
+    """Whether a generation request is deterministic enough for its result to be reused: it must have fixed seeds, and it must not save images to disk."""
+
+    if get_cache() is None:
+        return False
+
+    if req.seed == -1 or (req.subseed == -1 and req.subseed_strength != 0):
+        return False
+
+    return req.send_images and not req.save_images
+
+
+def file_id(filename):
+    """Identifies a version of a file without reading it."""
+
+    if filename is None:
+        return None
+
+    try:
+        return f"{filename}:{hashes.stat_key(cache.file_stat(filename))}"
+    except OSError:
+        return filename
+
+
+def checkpoint_and_vae(req):
+    """Returns identifiers of the checkpoint and VAE a request is going to be generated with, taking its override_settings into account."""
+
+    override_settings = req.override_settings or {}
+    checkpoint_name = override_settings.get("sd_model_checkpoint")
+    vae_setting = override_settings.get("sd_vae")
+
+    checkpoint_info = sd_models.get_closet_checkpoint_match(checkpoint_name) if checkpoint_name else getattr(shared.sd_model, "sd_checkpoint_info", None)
+    if checkpoint_info is None:
+        return checkpoint_name, vae_setting
+
+    if checkpoint_name is None and vae_setting is None:
+        vae_file = sd_vae.loaded_vae_file
+    else:
+        vae_file = sd_vae.resolve_vae(checkpoint_info.filename, vae_setting).vae
+
+    return file_id(checkpoint_info.filename), file_id(vae_file)
+
+
+def key(kind, req):
+    """Returns a key identifying output of a request: it covers all request parameters, checkpoint and VAE used for it, and settings."""
+
+    checkpoint, vae = checkpoint_and_vae(req)
+
+    data = {
+        "kind": kind,
+        "request": {k: v for k, v in req.dict().items() if k not in ignored_fields},
+        "checkpoint": checkpoint,
+        "vae": vae,
+        "settings": shared.opts.data,
+    }
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get(cache_key):
+    """Returns a tuple of base64 images and info for a previously stored result, or None."""
+
+    global hits, misses
+
+    results_cache = get_cache()
+    if results_cache is None:
+        return None
+
+    res = results_cache.get(cache_key)
+
+    with results_lock:
+        if res is None:
+            misses += 1
+        else:
+            hits += 1
+
+    return res
+
+
+def put(cache_key, images, info):
+    results_cache = get_cache()
+    if results_cache is None:
+        return
+
+    results_cache.set(cache_key, (images, info))
+
+
+def stats():
+    results_cache = get_cache()
+
+    with results_lock:
+        lookups = hits + misses
+
+        return {
+            "entries": len(results_cache) if results_cache is not None else 0,
+            "size": results_cache.volume() if results_cache is not None else 0,
+            "size_limit": results_cache.size_limit if results_cache is not None else 0,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else None,
+        }
@@ -0,0 +1,89 @@
+import contextvars
+import json
+import queue
+import threading
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from modules import errors, queue_scheduler
+
+
+class MultipartImageStream:
+    """Runs a generation on a background thread and sends its images as parts of a multipart/mixed response as soon as they are made.
+
+    Each image is sent as a binary part; the last part is a JSON document with the same content as a regular JSON response.
+
+    The response is only returned once the generation has been admitted into the queue, so that errors raised before
+    that, such as an unknown sampler or a full queue, are reported with their own HTTP status instead of a 200.
+    """
+
+    def __init__(self, encode_image, content_type):
+        self.encode_image = encode_image
+        self.content_type = content_type
+        self.boundary = uuid.uuid4().hex
+        self.queue = queue.Queue()
+        self.sent_images = set()
+        self.admitted = threading.Event()
+        self.early_error = None
+
+    def add_image(self, image, infotext=None):
+        # the same image can be reported twice: once when generated, and again as part of final result
+        if id(image) in self.sent_images:
+            return
+
+        self.sent_images.add(id(image))
+        self.queue.put(("image", image))
+
+    def run(self, func):
+        """Calls func(image_callback) on a new thread and returns a streaming response with everything it produces; func must return the JSON part of the response."""
+
+        def target():
+            try:
+                with queue_scheduler.request_context(on_admitted=self.admitted.set):
+                    self.queue.put(("result", func(self.add_image)))
+            except Exception as e:
+                if not self.admitted.is_set():
+                    self.early_error = e
+                else:
+                    errors.report("Error generating streamed response", exc_info=True)
+                    self.queue.put(("error", e))
+            finally:
+                self.admitted.set()
+
+        # copy context so that the generation is queued with the same priority and client as the request
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(target,), daemon=True, name="API image stream").start()
+
+        self.admitted.wait()
+        if self.early_error is not None:
+            raise self.early_error
+
+        return StreamingResponse(self.parts(), media_type=f"multipart/mixed; boundary={self.boundary}")
+
+    def part(self, content_type, data, *headers):
+        head = "".join(f"{header}\r\n" for header in (f"Content-Type: {content_type}", f"Content-Length: {len(data)}", *headers))
+        return f"--{self.boundary}\r\n{head}\r\n".encode() + data + b"\r\n"
+
+    def json_part(self, obj):
+        return self.part("application/json", json.dumps(jsonable_encoder(obj)).encode())
+
+    def parts(self):
+        extension = self.content_type.split("/")[-1]
+        index = 0
+
+        while True:
+            kind, value = self.queue.get()
+
+            if kind == "image":
+                yield self.part(self.content_type, self.encode_image(value), f'Content-Disposition: inline; filename="{index}.{extension}"')
+                index += 1
+            elif kind == "result":
+                yield self.json_part(value)
+                break
+            else:
+                yield self.json_part({"error": type(value).__name__, "detail": vars(value).get('detail', ''), "errors": str(value)})
+                break
+
+        yield f"--{self.boundary}--\r\n".encode()
@@ -1,3 +1,5 @@
+import concurrent.futures
+import contextlib
 import json
 import os
 import os.path
@@ -12,6 +14,7 @@ cache_filename = os.environ.get('SD_WEBUI_CACHE_FILE', os.path.join(data_path, "
 cache_dir = os.environ.get('SD_WEBUI_CACHE_DIR', os.path.join(data_path, "cache"))
 caches = {}
 cache_lock = threading.Lock()
+scanned = threading.local()
 
 
 def dump_cache():
@@ -102,7 +105,7 @@ def cached_data_for_file(subsection, title, filename, func):
     """
 
     existing_cache = cache(subsection)
-    ondisk_mtime = os.path.getmtime(filename)
+    ondisk_mtime = file_stat(filename).st_mtime
 
     entry = existing_cache.get(title)
     if entry:
@@ -121,3 +124,74 @@ def cached_data_for_file(subsection, title, filename, func):
         dump_cache()
 
     return entry['value']
+
+
+def scan_directory(path, entries):
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        scan_directory(entry.path, entries)
+                    elif entry.is_file():
+                        entries.append(entry)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def stat_directories(*paths):
+    """
+    Within the block, file_stat() returns stats of files under paths that were gathered in one pass: directories are
+    listed with os.scandir, and files are statted in parallel, which hides per-file latency of network filesystems.
+    """
+
+    entries = []
+    for path in paths:
+        if path and os.path.isdir(path):
+            scan_directory(path, entries)
+
+    def stat(entry):
+        try:
+            return os.path.abspath(entry.path), entry.stat()
+        except OSError:
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        stats = dict(x for x in executor.map(stat, entries) if x is not None)
+
+    with known_file_stats(stats):
+        yield
+
+
+@contextlib.contextmanager
+def known_file_stats(stats):
+    """
+    Within the block, file_stat() returns results from stats, a dict of filename -> os.stat result, for files in it.
+    Like stat_directories(), only affects the current thread; use it to pass stats gathered on one thread to another.
+    """
+
+    stats = {os.path.abspath(filename): stat for filename, stat in stats.items()}
+
+    previous = getattr(scanned, "stats", None)
+    scanned.stats = stats if previous is None else {**previous, **stats}
+    try:
+        yield
+    finally:
+        scanned.stats = previous
+
+
+def file_stat(filename):
+    """Same as os.stat(filename), but uses results gathered by stat_directories() when called within it."""
+
+    stats = getattr(scanned, "stats", None)
+    if stats is not None:
+        stat = stats.get(os.path.abspath(filename))
+
+        # DirEntry.stat() on Windows has no inode or device
+        if stat is not None and stat.st_ino != 0:
+            return stat
+
+    return os.stat(filename)
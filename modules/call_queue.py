@@ -3,9 +3,9 @@ from functools import wraps
 import html
 import time
 
-from modules import shared, progress, errors, devices, fifo_lock, profiling
+from modules import shared, progress, errors, devices, queue_scheduler, profiling
 
-queue_lock = fifo_lock.FIFOLock()
+queue_lock = queue_scheduler.QueueScheduler(max_depth=lambda: shared.opts.api_queue_max_depth)
 
 
 def wrap_queued_call(func):
@@ -29,7 +29,7 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         else:
             id_task = None
 
-        with queue_lock:
+        with queue_scheduler.request_context(id_task=id_task), queue_lock:
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
 
@@ -0,0 +1,122 @@
+import collections
+import threading
+
+import torch
+
+from modules import extra_networks, shared
+
+
+def hashable(obj):
+    """Converts lists, dicts and extra network parameters found in cached_params into tuples, so that they can be used as a dict key."""
+
+    if isinstance(obj, (list, tuple)):
+        return tuple(hashable(x) for x in obj)
+
+    if isinstance(obj, dict):
+        return tuple(sorted((k, hashable(v)) for k, v in obj.items()))
+
+    if isinstance(obj, extra_networks.ExtraNetworkParams):
+        return hashable(obj.items)
+
+    return obj
+
+
+def tensor_bytes(obj):
+    """Returns total size of tensors in a conditioning object: a tensor, or lists, dicts and objects containing them."""
+
+    if isinstance(obj, torch.Tensor):
+        return obj.element_size() * obj.nelement()
+
+    if isinstance(obj, dict):
+        return sum(tensor_bytes(x) for x in obj.values())
+
+    if isinstance(obj, (list, tuple)):
+        return sum(tensor_bytes(x) for x in obj)
+
+    if hasattr(obj, '__dict__'):
+        return sum(tensor_bytes(x) for x in vars(obj).values())
+
+    return 0
+
+
+def current_text_encoder_state():
+    return shared.sd_model.sd_checkpoint_info, shared.opts.CLIP_stop_at_last_layers, shared.opts.emphasis
+
+
+class CondCache:
+    """An LRU cache of conditioning tensors, limited by total size of tensors in it.
+
+    size_limit is a function returning the limit in bytes. All entries are dropped when the value returned by
+    the generation function changes; by default that happens when checkpoint, CLIP skip or emphasis mode
+    changes, since no entry made before the change can be used after it.
+    """
+
+    def __init__(self, size_limit, generation=current_text_encoder_state):
+        self.size_limit = size_limit
+        self.generation_func = generation
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def check_generation(self):
+        generation = self.generation_func()
+        if generation != self.generation:
+            self.entries.clear()
+            self.size = 0
+            self.generation = generation
+
+    def get(self, key):
+        with self.lock:
+            self.check_generation()
+
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size_limit = self.size_limit()
+        size = tensor_bytes(value)
+        if size > size_limit:
+            return
+
+        with self.lock:
+            self.check_generation()
+
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > size_limit:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "size_limit": self.size_limit(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+cache = CondCache(size_limit=lambda: int(shared.opts.cond_cache_size * 1024 * 1024))
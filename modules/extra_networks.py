@@ -9,6 +9,9 @@ from modules import errors
 extra_network_registry = {}
 extra_network_aliases = {}
 
+# arguments of currently activated extra networks in hashable form, for caches of outputs of networks they modify
+active_networks = ()
+
 
 def initialize():
     extra_network_registry.clear()
@@ -127,6 +130,8 @@ def activate(p, extra_network_data):
     """call activate for extra networks in extra_network_data in specified order, then call
     activate for all remaining registered networks with an empty argument list"""
 
+    global active_networks
+
     activated = []
 
     for extra_network, extra_network_args in lookup_extra_networks(extra_network_data).items():
@@ -146,6 +151,8 @@ def activate(p, extra_network_data):
         except Exception as e:
             errors.display(e, f"activating extra network {extra_network_name}")
 
+    active_networks = tuple((name, tuple(tuple(params.items) for params in args)) for name, args in extra_network_data.items())
+
     if p.scripts is not None:
         p.scripts.after_extra_networks_activate(p, batch_number=p.iteration, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds, extra_network_data=extra_network_data)
 
@@ -154,6 +161,10 @@ def deactivate(p, extra_network_data):
     """call deactivate for extra networks in extra_network_data in specified order, then call
     deactivate for all remaining registered networks"""
 
+    global active_networks
+
+    active_networks = ()
+
     data = lookup_extra_networks(extra_network_data)
 
     for extra_network in data:
@@ -19,28 +19,56 @@ def calculate_sha256(filename):
     return hash_sha256.hexdigest()
 
 
+def stat_key(stat):
+    """Identifies contents of a file by its device, inode, size and modification time, so that a renamed or moved file keeps its hash."""
+
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def title_entry(stat, sha256_value):
+    return {
+        "mtime": stat.st_mtime,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": sha256_value,
+    }
+
+
 def sha256_from_cache(filename, title, use_addnet_hash=False):
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
+    hashes_by_stat = cache("hashes-addnet-stat") if use_addnet_hash else cache("hashes-stat")
     try:
-        ondisk_mtime = os.path.getmtime(filename)
+        stat = modules.cache.file_stat(filename)
     except FileNotFoundError:
         return None
 
-    if title not in hashes:
+    key = stat_key(stat)
+    entry = hashes.get(title)
+
+    cached_sha256 = hashes_by_stat.get(key)
+    if cached_sha256 is not None:
+        if entry is None or entry.get("sha256") != cached_sha256:
+            hashes[title] = title_entry(stat, cached_sha256)
+
+        return cached_sha256
+
+    # entries made before hashes were stored by stat_key only have the modification time to check
+    if entry is None or "mtime_ns" in entry:
         return None
 
-    cached_sha256 = hashes[title].get("sha256", None)
-    cached_mtime = hashes[title].get("mtime", 0)
+    cached_sha256 = entry.get("sha256", None)
+    cached_mtime = entry.get("mtime", 0)
 
-    if ondisk_mtime > cached_mtime or cached_sha256 is None:
+    if stat.st_mtime > cached_mtime or cached_sha256 is None:
         return None
 
+    hashes_by_stat[key] = cached_sha256
+    hashes[title] = title_entry(stat, cached_sha256)
+
     return cached_sha256
 
 
 def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
-
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,6 +76,8 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
+    stat = os.stat(filename)
+
     print(f"Calculating sha256 for {filename}: ", end='')
     if use_addnet_hash:
         with open(filename, "rb") as file:
@@ -56,16 +86,26 @@ def sha256(filename, title, use_addnet_hash=False):
         sha256_value = calculate_sha256(filename)
     print(f"{sha256_value}")
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
-
-    dump_cache()
+    store_sha256(filename, title, sha256_value, use_addnet_hash=use_addnet_hash, stat=stat)
 
     return sha256_value
 
 
+def store_sha256(filename, title, sha256_value, use_addnet_hash=False, stat=None):
+    """Puts a hash calculated elsewhere into cache; stat should be the result of os.stat() for the file before it was read."""
+
+    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
+    hashes_by_stat = cache("hashes-addnet-stat") if use_addnet_hash else cache("hashes-stat")
+
+    if stat is None:
+        stat = os.stat(filename)
+
+    hashes_by_stat[stat_key(stat)] = sha256_value
+    hashes[title] = title_entry(stat, sha256_value)
+
+    dump_cache()
+
+
 def addnet_hash_safetensors(b):
     """kohya-ss hash for safetensors from https://github.com/kohya-ss/sd-scripts/blob/main/library/train_util.py"""
     hash_sha256 = hashlib.sha256()
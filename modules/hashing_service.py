@@ -0,0 +1,197 @@
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from modules import errors, hashes, shared
+
+PRIORITY_NEEDED = 0
+"""for files used by generation that is running or queued"""
+
+PRIORITY_BACKGROUND = 1
+"""for files found by model listers"""
+
+
+class HashingTask:
+    def __init__(self, filename, title, use_addnet_hash, priority):
+        self.filename = filename
+        self.title = title
+        self.use_addnet_hash = use_addnet_hash
+        self.priority = priority
+        self.callbacks = []
+
+    def key(self):
+        return self.title, self.use_addnet_hash
+
+
+class HashingService:
+    """Calculates sha256 of model files on a background thread, one file at a time, so that generation does not have to.
+
+    Files are hashed in order of priority, then in the order they were submitted. Reading speed is limited by the
+    hashing_service_rate_limit setting to leave disk bandwidth for loading models. Results are stored in the same
+    cache as hashes.sha256() uses.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.heap = []
+        self.tasks = {}
+        self.seq = itertools.count()
+        self.thread = None
+
+        self.current = None
+        self.current_read = 0
+        self.current_size = 0
+        self.hashed = 0
+        self.failed = 0
+
+    def enabled(self):
+        return shared.opts.hashing_service_enable and not shared.cmd_opts.no_hashing
+
+    def submit(self, filename, title, use_addnet_hash=False, priority=PRIORITY_BACKGROUND, callback=None):
+        """Queues a file for hashing, unless its hash is already in cache; callback, if set, is called with the hash once it's calculated."""
+
+        if not self.enabled():
+            return
+
+        if hashes.sha256_from_cache(filename, title, use_addnet_hash) is not None:
+            return
+
+        task = HashingTask(filename, title, use_addnet_hash, priority)
+
+        with self.lock:
+            existing = self.tasks.get(task.key())
+            if existing is not None and (existing is self.current or existing.priority <= priority):
+                existing.priority = min(existing.priority, priority)
+                if callback is not None:
+                    existing.callbacks.append(callback)
+                return
+
+            if existing is not None:
+                # resubmitted with higher priority; the old heap entry is skipped when it comes up
+                task.callbacks = existing.callbacks
+                existing.priority = None
+
+            if callback is not None:
+                task.callbacks.append(callback)
+
+            self.tasks[task.key()] = task
+            heapq.heappush(self.heap, (priority, next(self.seq), task))
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True, name="Hashing service")
+                self.thread.start()
+
+        self.wakeup.set()
+
+    def take(self):
+        with self.lock:
+            while self.heap:
+                _, _, task = heapq.heappop(self.heap)
+                if task.priority is None:
+                    continue
+
+                self.current = task
+                self.current_read = 0
+                self.current_size = 0
+                return task
+
+            self.current = None
+            return None
+
+    def run(self):
+        while True:
+            task = self.take()
+            if task is None:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            try:
+                sha256 = hashes.sha256_from_cache(task.filename, task.title, task.use_addnet_hash)
+                if sha256 is None:
+                    stat = os.stat(task.filename)
+                    sha256 = self.calculate(task)
+                    hashes.store_sha256(task.filename, task.title, sha256, use_addnet_hash=task.use_addnet_hash, stat=stat)
+                    self.hashed += 1
+            except Exception:
+                errors.report(f"Error hashing {task.filename}", exc_info=True)
+                self.failed += 1
+                sha256 = None
+
+            with self.lock:
+                self.tasks.pop(task.key(), None)
+                self.current = None
+
+            if sha256 is not None:
+                for callback in task.callbacks:
+                    try:
+                        callback(sha256)
+                    except Exception:
+                        errors.report(f"Error in callback for hash of {task.filename}", exc_info=True)
+
+    def calculate(self, task):
+        """Same as hashes.calculate_sha256/hashes.addnet_hash_safetensors, but reads the file no faster than the rate limit allows."""
+
+        hash_sha256 = hashlib.sha256()
+        blksize = 1024 * 1024
+        start = time.time()
+
+        with open(task.filename, "rb") as file:
+            offset = 0
+            if task.use_addnet_hash:
+                offset = int.from_bytes(file.read(8), "little") + 8
+                file.seek(offset)
+
+            self.current_size = os.fstat(file.fileno()).st_size - offset
+
+            for chunk in iter(lambda: file.read(blksize), b""):
+                hash_sha256.update(chunk)
+                self.current_read += len(chunk)
+
+                # a task needed by generation is not throttled
+                rate_limit = shared.opts.hashing_service_rate_limit * 1024 * 1024
+                if rate_limit > 0 and task.priority != PRIORITY_NEEDED:
+                    delay = start + self.current_read / rate_limit - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+        return hash_sha256.hexdigest()
+
+    def status(self):
+        with self.lock:
+            queued = [task for task in self.tasks.values() if task is not self.current]
+            current = self.current
+
+            return {
+                "enabled": self.enabled(),
+                "queued": len(queued),
+                "queued_needed": len([task for task in queued if task.priority == PRIORITY_NEEDED]),
+                "hashed": self.hashed,
+                "failed": self.failed,
+                "current": current.title if current else None,
+                "current_progress": self.current_read / self.current_size if current and self.current_size else None,
+            }
+
+
+service = HashingService()
+
+
+def sha256(filename, title, use_addnet_hash=False, callback=None, priority=PRIORITY_NEEDED):
+    """
+    Returns sha256 of a file from cache. If it is not in cache, and the hashing service is enabled, queues the file for
+    hashing with the specified priority and returns None; callback is called with the hash once it's ready. If the
+    service is disabled, calculates the hash right away, same as hashes.sha256().
+    """
+
+    if not service.enabled():
+        return hashes.sha256(filename, title, use_addnet_hash)
+
+    sha256_value = hashes.sha256_from_cache(filename, title, use_addnet_hash)
+    if sha256_value is None:
+        service.submit(filename, title, use_addnet_hash, priority=priority, callback=callback)
+
+    return sha256_value
@@ -10,7 +10,7 @@ import torch
 import tqdm
 from einops import rearrange, repeat
 from ldm.util import default
-from modules import devices, sd_models, shared, sd_samplers, hashes, sd_hijack_checkpoint, errors
+from modules import devices, sd_models, shared, sd_samplers, hashing_service, sd_hijack_checkpoint, errors
 from modules.textual_inversion import textual_inversion, saving_settings
 from modules.textual_inversion.learn_schedule import LearnRateScheduler
 from torch import einsum
@@ -304,7 +304,7 @@ class Hypernetwork:
         self.eval()
 
     def shorthash(self):
-        sha256 = hashes.sha256(self.filename, f'hypernet/{self.name}')
+        sha256 = hashing_service.sha256(self.filename, f'hypernet/{self.name}')
 
         return sha256[0:10] if sha256 else None
 
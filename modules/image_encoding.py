@@ -0,0 +1,84 @@
+import concurrent.futures
+import threading
+
+from modules import errors, shared
+
+executor = None
+executor_threads = 0
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the shared thread pool used to compress images, or None if parallel encoding is disabled in settings."""
+
+    global executor, executor_threads
+
+    threads = shared.opts.image_encoding_threads
+    if threads <= 0:
+        return None
+
+    with executor_lock:
+        if executor is None or executor_threads != threads:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image encoding")
+            executor_threads = threads
+
+        return executor
+
+
+def map(func, items):
+    """Like builtin map, but runs func for items in the encoding thread pool; returns a list with results in the same order."""
+
+    items = list(items)
+    pool = get_executor()
+    if pool is None or len(items) < 2:
+        return [func(x) for x in items]
+
+    return list(pool.map(func, items))
+
+
+class EncodingQueue:
+    """Runs image encoding/saving tasks in background while the caller continues with its work.
+
+    At most twice the number of encoding threads tasks are allowed to be pending; submit() blocks until one of them
+    finishes when there are more, so that images waiting to be saved do not accumulate in memory if sampling is
+    faster than saving. If parallel encoding is disabled, submit() runs tasks immediately.
+
+    When used as a context manager, waits for pending tasks on exit, including when an exception is raised, so that
+    tasks do not keep using objects the caller cleans up afterwards.
+    """
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs):
+        pool = get_executor()
+        if pool is None:
+            return func(*args, **kwargs)
+
+        self.futures = [x for x in self.futures if not x.done()]
+        if len(self.futures) >= shared.opts.image_encoding_threads * 2:
+            concurrent.futures.wait(self.futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        future = pool.submit(func, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """Waits for all submitted tasks to complete; errors are reported rather than raised, same as for other failures to save an image."""
+
+        futures, self.futures = self.futures, []
+
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                errors.report("Error encoding image", exc_info=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wait()
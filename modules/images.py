@@ -18,6 +18,7 @@ import pillow_avif # noqa: F401
 import string
 import json
 import hashlib
+import threading
 
 from modules import sd_samplers, shared, script_callbacks, errors
 from modules.paths_internal import roboto_ttf_file
@@ -540,6 +541,11 @@ class FilenameGenerator:
         return res
 
 
+# sequence numbers picked by save_image calls whose files are not written yet; makes it possible to save images from several threads at once
+sequence_numbers_in_use = {}
+sequence_numbers_lock = threading.Lock()
+
+
 def get_next_sequence_number(path, basename):
     """
     Determines and returns the next sequence number to use when saving an image in the specified directory.
@@ -655,6 +661,7 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If a text file is saved for this image, this will be its full path. Otherwise None.
     """
     namegen = FilenameGenerator(p, seed, prompt, image, basename=basename)
+    sequence_number = None
 
     # WebP and JPG formats have maximum dimension limits of 16383 and 65535 respectively. switch to PNG which has a much higher limit
     if (image.height > 65535 or image.width > 65535) and extension.lower() in ("jpg", "jpeg") or (image.height > 16383 or image.width > 16383) and extension.lower() == "webp":
@@ -686,13 +693,18 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             file_decoration = f"-{file_decoration}"
 
         if add_number:
-            basecount = get_next_sequence_number(path, basename)
-            fullfn = None
-            for i in range(500):
-                fn = f"{basecount + i:05}" if basename == '' else f"{basename}-{basecount + i:04}"
-                fullfn = os.path.join(path, f"{fn}{file_decoration}.{extension}")
-                if not os.path.exists(fullfn):
-                    break
+            with sequence_numbers_lock:
+                numbers_in_use = sequence_numbers_in_use.setdefault((path, basename), set())
+                basecount = max(get_next_sequence_number(path, basename), max(numbers_in_use, default=-1) + 1)
+                fullfn = None
+                for i in range(500):
+                    fn = f"{basecount + i:05}" if basename == '' else f"{basename}-{basecount + i:04}"
+                    fullfn = os.path.join(path, f"{fn}{file_decoration}.{extension}")
+                    if not os.path.exists(fullfn):
+                        break
+
+                sequence_number = basecount + i
+                numbers_in_use.add(sequence_number)
         else:
             fullfn = os.path.join(path, f"{file_decoration}.{extension}")
     else:
@@ -731,7 +743,15 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
         fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
         params.filename = fullfn_without_extension + extension
         fullfn = params.filename
-    _atomically_save_image(image, fullfn_without_extension, extension)
+    try:
+        _atomically_save_image(image, fullfn_without_extension, extension)
+    finally:
+        if sequence_number is not None:
+            with sequence_numbers_lock:
+                numbers_in_use = sequence_numbers_in_use[(path, basename)]
+                numbers_in_use.discard(sequence_number)
+                if not numbers_in_use:
+                    del sequence_numbers_in_use[(path, basename)]
 
     image.already_saved_as = fullfn
 
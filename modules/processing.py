@@ -1,4 +1,5 @@
 from __future__ import annotations
+import copy
 import json
 import logging
 import math
@@ -16,7 +17,7 @@ from skimage import exposure
 from typing import Any
 
 import modules.sd_hijack
-from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling
+from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling, image_encoding, cond_cache
 from modules.rng import slerp # noqa: F401
 from modules.sd_hijack import model_hijack
 from modules.sd_samplers_common import images_tensor_to_samples, decode_first_stage, approximation_indexes
@@ -225,6 +226,9 @@ class StableDiffusionProcessing:
 
     is_api: bool = field(default=False, init=False)
 
+    # if set, called with (image, infotext) for every generated image as soon as its batch is finished
+    image_callback: Any = field(default=None, init=False)
+
     def __post_init__(self):
         if self.sampler_index is not None:
             print("sampler_index argument for StableDiffusionProcessing does not do anything; use sampler_name", file=sys.stderr)
@@ -468,6 +472,9 @@ class StableDiffusionProcessing:
         computed result is stored.
 
         caches is a list with items described above.
+
+        Results are also kept in cond_cache.cache, shared by all processing objects, so that conds for
+        recently used prompts are not recalculated even if other prompts were used since.
         """
 
         if shared.opts.use_old_scheduling:
@@ -484,9 +491,21 @@ class StableDiffusionProcessing:
 
         cache = caches[0]
 
+        use_shared_cache = opts.persistent_cond_cache and opts.cond_cache_size > 0
+        if use_shared_cache:
+            shared_cache_key = (function, getattr(required_prompts, 'is_negative_prompt', False), cond_cache.hashable(cached_params))
+            cond = cond_cache.cache.get(shared_cache_key)
+            if cond is not None:
+                cache[0] = cached_params
+                cache[1] = cond
+                return cond
+
         with devices.autocast():
             cache[1] = function(shared.sd_model, required_prompts, steps, hires_steps, shared.opts.use_old_scheduling)
 
+        if use_shared_cache:
+            cond_cache.cache.put(shared_cache_key, cache[1])
+
         cache[0] = cached_params
         return cache[1]
 
@@ -825,7 +844,10 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
     try:
         # if no checkpoint override or the override checkpoint can't be found, remove override entry and load opts checkpoint
         # and if after running refiner, the refiner model is not unloaded - webui swaps back to main model here, if model over is present it will be reloaded afterwards
-        if sd_models.checkpoint_aliases.get(p.override_settings.get('sd_model_checkpoint')) is None:
+        with sd_models.checkpoints_lock:
+            override_checkpoint = sd_models.checkpoint_aliases.get(p.override_settings.get('sd_model_checkpoint'))
+
+        if override_checkpoint is None:
             p.override_settings.pop('sd_model_checkpoint', None)
             sd_models.reload_model_weights()
 
@@ -916,7 +938,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
     infotexts = []
     output_images = []
-    with torch.no_grad(), p.sd_model.ema_scope():
+    encoding_queue = image_encoding.EncodingQueue()
+    with torch.no_grad(), p.sd_model.ema_scope(), encoding_queue:
         with devices.autocast():
             p.init(p.all_prompts, p.all_seeds, p.all_subseeds)
 
@@ -1082,7 +1105,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     image = pp.image
 
                 if save_samples:
-                    images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p)
+                    # a copy of p is used because batch_index and seeds change before the image is saved in background
+                    encoding_queue.submit(images.save_image, image, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=copy.copy(p))
 
                 text = infotext(i)
                 infotexts.append(text)
@@ -1090,18 +1114,21 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     image.info["parameters"] = text
                 output_images.append(image)
 
+                if p.image_callback is not None:
+                    p.image_callback(image, text)
+
                 if mask_for_overlay is not None:
                     if opts.return_mask or opts.save_mask:
                         image_mask = mask_for_overlay.convert('RGB')
                         if save_samples and opts.save_mask:
-                            images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask")
+                            encoding_queue.submit(images.save_image, image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=copy.copy(p), suffix="-mask")
                         if opts.return_mask:
                             output_images.append(image_mask)
 
                     if opts.return_mask_composite or opts.save_mask_composite:
                         image_mask_composite = Image.composite(original_denoised_image.convert('RGBA').convert('RGBa'), Image.new('RGBa', image.size), images.resize_image(2, mask_for_overlay, image.width, image.height).convert('L')).convert('RGBA')
                         if save_samples and opts.save_mask_composite:
-                            images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-mask-composite")
+                            encoding_queue.submit(images.save_image, image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=copy.copy(p), suffix="-mask-composite")
                         if opts.return_mask_composite:
                             output_images.append(image_mask_composite)
 
@@ -1109,6 +1136,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
             devices.torch_gc()
 
+        encoding_queue.wait()
+
         if not infotexts:
             infotexts.append(Processed(p, []).infotext(p, 0))
 
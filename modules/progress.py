@@ -1,13 +1,19 @@
+import asyncio
 import base64
 import io
+import threading
 import time
 
 import gradio as gr
+from fastapi import Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 
 from modules.shared import opts
 
 import modules.shared as shared
+from modules import errors, sd_models_prefetch
 from collections import OrderedDict
 import string
 import random
@@ -18,6 +24,9 @@ pending_tasks = OrderedDict()
 finished_tasks = []
 recorded_results = []
 recorded_results_limit = 2
+live_preview_lock = threading.Lock()
+live_preview_cache = None
+unknown_task_grace_period = 5
 
 
 def start_task(id_task):
@@ -26,6 +35,9 @@ def start_task(id_task):
     current_task = id_task
     pending_tasks.pop(id_task, None)
 
+    # while this task runs, the checkpoint for the next one can be loaded
+    sd_models_prefetch.prefetcher.notify()
+
 
 def finish_task(id_task):
     global current_task
@@ -52,9 +64,21 @@ def record_results(id_task, res):
 def add_task_to_queue(id_job):
     pending_tasks[id_job] = time.time()
 
+
+def queued_task_ids():
+    """Returns ids of pending tasks in the order the queue scheduler is going to run them"""
+    from modules.call_queue import queue_lock
+
+    waiting = [waiter.id_task for waiter in queue_lock.pending() if waiter.id_task in pending_tasks]
+    waiting_set = set(waiting)
+
+    queued = list(pending_tasks.items())
+    return waiting + [x for x, _ in sorted(queued, key=lambda x: x[1]) if x not in waiting_set]
+
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
-    tasks: List[str] = Field(title="Pending task ids")
+    tasks: List[str] = Field(title="Pending task ids", description="In the order they are going to be run")
+    queue: List[dict] = Field(default=[], title="Queue", description="Requests waiting for the queue lock, with their priority class and client")
 
 class ProgressRequest(BaseModel):
     id_task: str = Field(default=None, title="Task ID", description="id of the task to get progress for")
@@ -71,17 +95,22 @@ class ProgressResponse(BaseModel):
     live_preview: str = Field(default=None, title="Live preview image", description="Current live preview; a data: uri")
     id_live_preview: int = Field(default=None, title="Live preview image ID", description="Send this together with next request to prevent receiving same image")
     textinfo: str = Field(default=None, title="Info text", description="Info text used by WebUI.")
+    queue_position: int = Field(default=None, title="Queue position", description="1-based position of the task in queue; only set while the task is queued")
 
 
 def setup_progress_api(app):
     app.add_api_route("/internal/pending-tasks", get_pending_tasks, methods=["GET"])
+    app.add_api_route("/internal/progress-stream", progress_stream, methods=["GET"])
     return app.add_api_route("/internal/progress", progressapi, methods=["POST"], response_model=ProgressResponse)
 
 
 def get_pending_tasks():
-    pending_tasks_ids = list(pending_tasks)
+    from modules.call_queue import queue_lock
+
+    pending_tasks_ids = queued_task_ids()
     pending_len = len(pending_tasks_ids)
-    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids)
+    queue = [waiter.dict() for waiter in queue_lock.pending()]
+    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids, queue=queue)
 
 
 def progressapi(req: ProgressRequest):
@@ -91,11 +120,13 @@ def progressapi(req: ProgressRequest):
 
     if not active:
         textinfo = "Waiting..."
+        queue_position = None
         if queued:
-            sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
+            sorted_queued = queued_task_ids()
             queue_index = sorted_queued.index(req.id_task)
+            queue_position = queue_index + 1
             textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
-        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
+        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo, queue_position=queue_position)
 
     progress = 0
 
@@ -119,26 +150,133 @@ def progressapi(req: ProgressRequest):
     if opts.live_previews_enable and req.live_preview:
         shared.state.set_current_image()
         if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
+            current_id_live_preview = shared.state.id_live_preview
+            live_preview = encode_live_preview(shared.state.current_image)
+            if live_preview is not None:
+                id_live_preview = current_id_live_preview
 
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
+    return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
 
-                else:
-                    save_kwargs = {}
 
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
-                id_live_preview = shared.state.id_live_preview
+def encode_live_preview(image):
+    """Returns live preview image as a data: uri; the last encoded image is remembered, so that all clients asking for the same preview share one encode"""
 
-    return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
+    global live_preview_cache
+
+    if image is None:
+        return None
+
+    image_format = opts.live_previews_image_format
+
+    with live_preview_lock:
+        if live_preview_cache is not None and live_preview_cache[0] is image and live_preview_cache[1] == image_format:
+            return live_preview_cache[2]
+
+        buffered = io.BytesIO()
+
+        if image_format == "png":
+            # using optimize for large images takes an enormous amount of time
+            if max(*image.size) <= 256:
+                save_kwargs = {"optimize": True}
+            else:
+                save_kwargs = {"optimize": False, "compress_level": 1}
+
+        else:
+            save_kwargs = {}
+
+        image.save(buffered, format=image_format, **save_kwargs)
+        base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+        data_uri = f"data:image/{image_format};base64,{base64_image}"
+
+        live_preview_cache = (image, image_format, data_uri)
+
+    return data_uri
+
+
+class ProgressPublisher:
+    """Gets progress once per refresh period for every task that has progress stream subscribers, and sends it to all of them, so that the work does not grow with the number of clients watching"""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.task = None
+
+    def subscribe(self, id_task, live_preview):
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault((id_task, live_preview), set()).add(queue)
+
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+        return queue
+
+    def unsubscribe(self, id_task, live_preview, queue):
+        queues = self.subscribers.get((id_task, live_preview))
+        if queues is None:
+            return
+
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[(id_task, live_preview)]
+
+    async def run(self):
+        try:
+            while self.subscribers:
+                for (id_task, live_preview), queues in list(self.subscribers.items()):
+                    try:
+                        res = await run_in_threadpool(progressapi, ProgressRequest(id_task=id_task, live_preview=live_preview))
+                    except Exception:
+                        errors.report(f"Error getting progress for {id_task}", exc_info=True)
+                        continue
+
+                    # a subscriber that has not taken the previous result yet only gets the latest one
+                    for queue in list(queues):
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(res)
+
+                await asyncio.sleep(max(opts.live_preview_refresh_period, 100) / 1000)
+        finally:
+            self.task = None
+
+
+progress_publisher = ProgressPublisher()
+
+
+async def progress_stream(request: Request, id_task: str = None, live_preview: bool = True):
+    """
+    Streams progress of a task as server-sent events; an event is only sent when progress changes, and a live preview image only when there is a new one.
+    The stream ends when the task is finished, or when it is neither queued nor running.
+    """
+
+    async def events():
+        if id_task is None:
+            return
+
+        id_live_preview = -1
+        last_data = None
+        started = time.time()
+        queue = progress_publisher.subscribe(id_task, live_preview)
+
+        try:
+            while not await request.is_disconnected():
+                res = await queue.get()
+                if res.live_preview is not None and res.id_live_preview == id_live_preview:
+                    res = res.copy(update={"live_preview": None})
+                elif res.live_preview is not None:
+                    id_live_preview = res.id_live_preview
+
+                data = res.json()
+                if data != last_data:
+                    yield f"data: {data}\n\n"
+                    last_data = data
+
+                # a task can be unknown for a moment if the stream is opened before the request that makes the task is processed
+                if not res.active and not res.queued and (res.completed or time.time() - started > unknown_task_grace_period):
+                    break
+        finally:
+            progress_publisher.unsubscribe(id_task, live_preview, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 def restore_progress(id_task):
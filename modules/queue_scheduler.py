@@ -0,0 +1,162 @@
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+priority_names = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BULK: "bulk",
+}
+
+current_priority = contextvars.ContextVar("queue_priority", default=PRIORITY_INTERACTIVE)
+current_client = contextvars.ContextVar("queue_client", default="ui")
+current_task = contextvars.ContextVar("queue_task", default=None)
+current_on_admitted = contextvars.ContextVar("queue_on_admitted", default=None)
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Queue is full; retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+@contextlib.contextmanager
+def request_context(priority=None, client=None, id_task=None, on_admitted=None):
+    """Sets priority class, client name and task id used by QueueScheduler.acquire() for the current thread/coroutine.
+
+    on_admitted is called without arguments once acquire() has either taken the lock or put the request into the queue.
+    """
+
+    tokens = []
+    for var, value in ((current_priority, priority), (current_client, client), (current_task, id_task), (current_on_admitted, on_admitted)):
+        if value is not None:
+            tokens.append((var, var.set(value)))
+
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class Waiter:
+    def __init__(self, priority, client, id_task, tag, seq):
+        self.priority = priority
+        self.client = client
+        self.id_task = id_task
+        self.tag = tag
+        self.seq = seq
+        self.time = time.time()
+        self.event = threading.Event()
+
+    def sort_key(self):
+        return self.priority, self.tag, self.seq
+
+    def dict(self):
+        return {
+            "id_task": self.id_task,
+            "priority": priority_names.get(self.priority, str(self.priority)),
+            "client": self.client,
+            "waiting_since": self.time,
+        }
+
+
+class QueueScheduler:
+    """A lock for the GPU queue that hands the lock out by priority class and, within a class, fairly between clients.
+
+    Fairness uses start-time fair queueing: each waiter gets a virtual start tag one unit after the later of the
+    current virtual time and the tag of the same client's previous request, so a client that submitted many
+    requests at once is interleaved with everyone else rather than served all at once.
+
+    Priority class, client and task id are taken from context variables; see request_context(). API requests are
+    named by api.api_client_name(); all web UI requests use the default "ui" client, so users of the web UI share
+    a single fair share between them rather than getting one each.
+    """
+
+    def __init__(self, max_depth=None):
+        self.max_depth = max_depth
+        self._inner_lock = threading.Lock()
+        self._locked = False
+        self._waiters = []
+        self._seq = itertools.count()
+        self._virtual_time = 0
+        self._client_tags = {}
+        self._acquired_at = None
+        self._average_hold = 10.0
+
+    def _queue_limit(self):
+        limit = self.max_depth() if callable(self.max_depth) else self.max_depth
+        return limit or 0
+
+    def retry_after(self, queued=None):
+        """Estimated number of seconds until the queue has room for one more request; queued is the queue length, defaults to number of waiters."""
+
+        if queued is None:
+            queued = len(self._waiters)
+
+        return max(1, int(self._average_hold * (queued + 1)))
+
+    def acquire(self, blocking=True):
+        priority = current_priority.get()
+        on_admitted = current_on_admitted.get()
+
+        with self._inner_lock:
+            if not self._locked:
+                self._locked = True
+                self._acquired_at = time.time()
+                if on_admitted is not None:
+                    on_admitted()
+                return True
+            elif not blocking:
+                return False
+
+            limit = self._queue_limit()
+            if limit > 0 and priority != PRIORITY_INTERACTIVE and len(self._waiters) >= limit:
+                raise QueueFullError(self.retry_after())
+
+            client = current_client.get()
+            tag = max(self._virtual_time, self._client_tags.get(client, 0)) + 1
+            self._client_tags[client] = tag
+
+            waiter = Waiter(priority, client, current_task.get(), tag, next(self._seq))
+            self._waiters.append(waiter)
+
+        if on_admitted is not None:
+            on_admitted()
+
+        waiter.event.wait()
+        return True
+
+    def release(self):
+        with self._inner_lock:
+            if self._acquired_at is not None:
+                self._average_hold = self._average_hold * 0.8 + (time.time() - self._acquired_at) * 0.2
+
+            if not self._waiters:
+                self._locked = False
+                self._acquired_at = None
+                self._client_tags.clear()
+                return
+
+            waiter = min(self._waiters, key=Waiter.sort_key)
+            self._waiters.remove(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            self._acquired_at = time.time()
+
+            # ownership passes directly to the waiter; the lock stays locked
+            waiter.event.set()
+
+    def pending(self):
+        """Returns waiters in the order they will get the lock."""
+
+        with self._inner_lock:
+            return sorted(self._waiters, key=Waiter.sort_key)
+
+    __enter__ = acquire
+
+    def __exit__(self, t, v, tb):
+        self.release()
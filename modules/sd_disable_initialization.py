@@ -128,7 +128,7 @@ class DisableInitialization(ReplaceHelper):
 
 class InitializeOnMeta(ReplaceHelper):
     """
-    Context manager that causes all parameters for linear/conv2d/mha layers to be allocated on meta device,
+    Context manager that causes all parameters for linear/conv2d/mha/embedding layers to be allocated on meta device,
     which results in those parameters having no values and taking no memory. model.to() will be broken and
     will need to be repaired by using LoadStateDictOnMeta below when loading params from state dict.
 
@@ -150,6 +150,7 @@ class InitializeOnMeta(ReplaceHelper):
         linear_init = self.replace(torch.nn.Linear, '__init__', lambda *args, **kwargs: linear_init(*args, **set_device(kwargs)))
         conv2d_init = self.replace(torch.nn.Conv2d, '__init__', lambda *args, **kwargs: conv2d_init(*args, **set_device(kwargs)))
         mha_init = self.replace(torch.nn.MultiheadAttention, '__init__', lambda *args, **kwargs: mha_init(*args, **set_device(kwargs)))
+        embedding_init = self.replace(torch.nn.Embedding, '__init__', lambda *args, **kwargs: embedding_init(*args, **set_device(kwargs)))
         self.replace(torch.nn.Module, 'to', lambda *args, **kwargs: None)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -162,6 +163,11 @@ class LoadStateDictOnMeta(ReplaceHelper):
     As those parameters are read from state_dict, they will be deleted from it, so by the end state_dict will be mostly empty, to save memory.
     Meant to be used together with InitializeOnMeta above.
 
+    A parameter on meta device is made from the tensor in state_dict directly rather than allocated and then copied into.
+    With assign=True, the tensor itself becomes the parameter if it already has the right device and dtype (the same as
+    torch's load_state_dict(assign=True)), so for weights read into RAM with mmap, no memory is allocated for the model at all;
+    this must only be used when nothing else is going to use tensors from state_dict, since the model will change them.
+
     Usage:
     ```
     with sd_disable_initialization.LoadStateDictOnMeta(state_dict):
@@ -169,11 +175,12 @@ class LoadStateDictOnMeta(ReplaceHelper):
     ```
     """
 
-    def __init__(self, state_dict, device, weight_dtype_conversion=None):
+    def __init__(self, state_dict, device, weight_dtype_conversion=None, assign=False):
         super().__init__()
         self.state_dict = state_dict
         self.device = device
         self.weight_dtype_conversion = weight_dtype_conversion or {}
+        self.assign = assign
         self.default_dtype = self.weight_dtype_conversion.get('')
 
     def get_weight_dtype(self, key):
@@ -196,13 +203,19 @@ class LoadStateDictOnMeta(ReplaceHelper):
 
                 key = prefix + name
                 sd_param = sd.pop(key, None)
+
+                if param.is_meta and sd_param is not None:
+                    weight = sd_param.to(device=device, dtype=self.get_weight_dtype(key), copy=not self.assign)
+                    module._parameters[name] = torch.nn.parameter.Parameter(weight, requires_grad=param.requires_grad)
+                    state_dict.pop(key, None)
+                    continue
+
                 if sd_param is not None:
                     state_dict[key] = sd_param.to(dtype=self.get_weight_dtype(key))
                     used_param_keys.append(key)
 
                 if param.is_meta:
-                    dtype = sd_param.dtype if sd_param is not None else param.dtype
-                    module._parameters[name] = torch.nn.parameter.Parameter(torch.zeros_like(param, device=device, dtype=dtype), requires_grad=param.requires_grad)
+                    module._parameters[name] = torch.nn.parameter.Parameter(torch.zeros_like(param, device=device), requires_grad=param.requires_grad)
 
             for name in module._buffers:
                 key = prefix + name
@@ -3,7 +3,7 @@ from collections import namedtuple
 
 import torch
 
-from modules import prompt_parser, devices, sd_hijack, sd_emphasis
+from modules import prompt_parser, devices, sd_hijack, sd_emphasis, cond_cache, extra_networks
 from modules.shared import opts
 
 
@@ -26,6 +26,10 @@ PromptChunkFix = namedtuple('PromptChunkFix', ['offset', 'embedding'])
 chunk. Those objects are found in PromptChunk.fixes and, are placed into FrozenCLIPEmbedderWithCustomWordsBase.hijack.fixes, and finally
 are applied by sd_hijack.EmbeddingsWithFixes's forward function."""
 
+chunk_cache = cond_cache.CondCache(size_limit=lambda: int(opts.text_encoder_chunk_cache_size * 1024 * 1024))
+"""Outputs of process_tokens() for recently encoded chunks. A prompt that only differs from one used before in its
+last chunk only needs that chunk to be encoded."""
+
 
 class TextConditionalModel(torch.nn.Module):
     def __init__(self):
@@ -223,8 +227,7 @@ class TextConditionalModel(torch.nn.Module):
             for fixes in self.hijack.fixes:
                 for _position, embedding in fixes:
                     used_embeddings[embedding.name] = embedding
-            devices.torch_npu_set_device()
-            z = self.process_tokens(tokens, multipliers)
+            z = self.process_tokens_with_cache(tokens, multipliers)
             zs.append(z)
 
         if opts.textual_inversion_add_hashes_to_infotext and used_embeddings:
@@ -232,6 +235,7 @@ class TextConditionalModel(torch.nn.Module):
             for name, embedding in used_embeddings.items():
                 shorthash = embedding.shorthash
                 if not shorthash:
+                    embedding.request_hash()
                     continue
 
                 name = name.replace(":", "").replace(",", "")
@@ -250,6 +254,33 @@ class TextConditionalModel(torch.nn.Module):
         else:
             return torch.hstack(zs)
 
+    def process_tokens_with_cache(self, remade_batch_tokens, batch_multipliers):
+        """
+        same as process_tokens, but returns the result from chunk_cache if the same tokens with the same multipliers, textual
+        inversion embeddings and extra networks have been encoded before. The cache is not used when gradients are needed,
+        because then weights of embeddings can change between calls.
+        """
+
+        if opts.text_encoder_chunk_cache_size <= 0 or torch.is_grad_enabled():
+            devices.torch_npu_set_device()
+            return self.process_tokens(remade_batch_tokens, batch_multipliers)
+
+        key = (
+            id(self),
+            tuple(tuple(x) for x in remade_batch_tokens),
+            tuple(tuple(x) for x in batch_multipliers),
+            tuple(tuple(x) for x in self.hijack.fixes),
+            extra_networks.active_networks,
+        )
+
+        z = chunk_cache.get(key)
+        if z is None:
+            devices.torch_npu_set_device()
+            z = self.process_tokens(remade_batch_tokens, batch_multipliers)
+            chunk_cache.put(key, z)
+
+        return z
+
     def process_tokens(self, remade_batch_tokens, batch_multipliers):
         """
         sends one single prompt chunk to be encoded by transformers neural network.
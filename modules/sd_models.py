@@ -1,8 +1,11 @@
 import collections
+import hashlib
 import importlib
+import mmap
 import os
 import sys
 import threading
+import time
 import enum
 
 import torch
@@ -12,7 +15,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches, sd_models_prefetch, hashing_service, sd_models_fast_load, sd_models_delta
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -26,6 +29,9 @@ checkpoint_aliases = {}
 checkpoint_alisases = checkpoint_aliases  # for compatibility with old name
 checkpoints_loaded = collections.OrderedDict()
 
+checkpoints_lock = threading.RLock()
+"""Guards checkpoints_list and checkpoint_aliases: hashes calculated by the hashing service update them from its thread."""
+
 
 class ModelType(enum.Enum):
     SD1 = 1
@@ -96,34 +102,38 @@ class CheckpointInfo:
         self.short_title = self.name_for_extra if self.shorthash is None else f'{self.name_for_extra} [{self.shorthash}]'
 
         self.ids = [self.hash, self.model_name, self.title, name, self.name_for_extra, f'{name} [{self.hash}]']
+        self.architecture = sd_models_config.guess_model_architecture(self)
         if self.shorthash:
             self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
     def register(self):
-        checkpoints_list[self.title] = self
-        for id in self.ids:
-            checkpoint_aliases[id] = self
+        with checkpoints_lock:
+            checkpoints_list[self.title] = self
+            for id in self.ids:
+                checkpoint_aliases[id] = self
 
     def calculate_shorthash(self):
-        self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
+        # with the hashing service enabled, an unknown hash is calculated in background, and this is called again once it's ready
+        self.sha256 = hashing_service.sha256(self.filename, f"checkpoint/{self.name}", callback=lambda _: self.calculate_shorthash())
         if self.sha256 is None:
             return
 
         shorthash = self.sha256[0:10]
-        if self.shorthash == self.sha256[0:10]:
-            return self.shorthash
+        with checkpoints_lock:
+            if self.shorthash == shorthash:
+                return self.shorthash
 
-        self.shorthash = shorthash
+            self.shorthash = shorthash
 
-        if self.shorthash not in self.ids:
-            self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
+            if self.shorthash not in self.ids:
+                self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
-        old_title = self.title
-        self.title = f'{self.name} [{self.shorthash}]'
-        self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
+            old_title = self.title
+            self.title = f'{self.name} [{self.shorthash}]'
+            self.short_title = f'{self.name_for_extra} [{self.shorthash}]'
 
-        replace_key(checkpoints_list, old_title, self.title, self)
-        self.register()
+            replace_key(checkpoints_list, old_title, self.title, self)
+            self.register()
 
         return self.shorthash
 
@@ -147,13 +157,11 @@ def setup_model():
 
 
 def checkpoint_tiles(use_short=False):
-    return [x.short_title if use_short else x.title for x in checkpoints_list.values()]
+    with checkpoints_lock:
+        return [x.short_title if use_short else x.title for x in checkpoints_list.values()]
 
 
 def list_models():
-    checkpoints_list.clear()
-    checkpoint_aliases.clear()
-
     cmd_ckpt = shared.cmd_opts.ckpt
     if shared.cmd_opts.no_download_sd_model or cmd_ckpt != shared.sd_model_file or os.path.exists(cmd_ckpt):
         model_url = None
@@ -164,17 +172,24 @@ def list_models():
 
     model_list = modelloader.load_models(model_path=model_path, model_url=model_url, command_path=shared.cmd_opts.ckpt_dir, ext_filter=[".ckpt", ".safetensors"], download_name="v1-5-pruned-emaonly.safetensors", ext_blacklist=[".vae.ckpt", ".vae.safetensors"], hash_prefix=expected_sha256)
 
-    if os.path.exists(cmd_ckpt):
-        checkpoint_info = CheckpointInfo(cmd_ckpt)
-        checkpoint_info.register()
+    with checkpoints_lock, cache.stat_directories(model_path, shared.cmd_opts.ckpt_dir):
+        checkpoints_list.clear()
+        checkpoint_aliases.clear()
+
+        if os.path.exists(cmd_ckpt):
+            checkpoint_info = CheckpointInfo(cmd_ckpt)
+            checkpoint_info.register()
+
+            shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
+        elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
+            print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
 
-        shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
-    elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
-        print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
+        for filename in model_list:
+            checkpoint_info = CheckpointInfo(filename)
+            checkpoint_info.register()
 
-    for filename in model_list:
-        checkpoint_info = CheckpointInfo(filename)
-        checkpoint_info.register()
+        for checkpoint_info in list(checkpoints_list.values()):
+            hashing_service.service.submit(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
 
 
 re_strip_checksum = re.compile(r"\s*\[[^]]+]\s*$")
@@ -184,20 +199,21 @@ def get_closet_checkpoint_match(search_string):
     if not search_string:
         return None
 
-    checkpoint_info = checkpoint_aliases.get(search_string, None)
-    if checkpoint_info is not None:
-        return checkpoint_info
+    with checkpoints_lock:
+        checkpoint_info = checkpoint_aliases.get(search_string, None)
+        if checkpoint_info is not None:
+            return checkpoint_info
 
-    found = sorted([info for info in checkpoints_list.values() if search_string in info.title], key=lambda x: len(x.title))
-    if found:
-        return found[0]
+        found = sorted([info for info in checkpoints_list.values() if search_string in info.title], key=lambda x: len(x.title))
+        if found:
+            return found[0]
 
-    search_string_without_checksum = re.sub(re_strip_checksum, '', search_string)
-    found = sorted([info for info in checkpoints_list.values() if search_string_without_checksum in info.title], key=lambda x: len(x.title))
-    if found:
-        return found[0]
+        search_string_without_checksum = re.sub(re_strip_checksum, '', search_string)
+        found = sorted([info for info in checkpoints_list.values() if search_string_without_checksum in info.title], key=lambda x: len(x.title))
+        if found:
+            return found[0]
 
-    return None
+        return None
 
 
 def model_hash(filename):
@@ -219,11 +235,14 @@ def select_checkpoint():
     """Raises `FileNotFoundError` if no checkpoints are found."""
     model_checkpoint = shared.opts.sd_model_checkpoint
 
-    checkpoint_info = checkpoint_aliases.get(model_checkpoint, None)
-    if checkpoint_info is not None:
-        return checkpoint_info
+    with checkpoints_lock:
+        checkpoint_info = checkpoint_aliases.get(model_checkpoint, None)
+        if checkpoint_info is not None:
+            return checkpoint_info
+
+        checkpoint_info = next(iter(checkpoints_list.values()), None)
 
-    if len(checkpoints_list) == 0:
+    if checkpoint_info is None:
         error_message = "No checkpoints found. When searching for checkpoints, looked at:"
         if shared.cmd_opts.ckpt is not None:
             error_message += f"\n - file {os.path.abspath(shared.cmd_opts.ckpt)}"
@@ -233,7 +252,6 @@ def select_checkpoint():
         error_message += "Can't run without a checkpoint. Find and place a .ckpt or .safetensors file into any of those locations."
         raise FileNotFoundError(error_message)
 
-    checkpoint_info = next(iter(checkpoints_list.values()))
     if model_checkpoint is not None:
         print(f"Checkpoint {model_checkpoint} not found; loading fallback {checkpoint_info.title}", file=sys.stderr)
 
@@ -281,6 +299,35 @@ def get_state_dict_from_checkpoint(pl_sd):
     return pl_sd
 
 
+def get_state_dict_keys_from_header(header):
+    """Returns a dict that maps keys of tensors in a safetensors file to keys get_state_dict_from_checkpoint changes them to."""
+
+    is_sd2_turbo = header.get('conditioner.embedders.0.model.ln_final.weight', {}).get("shape", [0])[0] == 1024
+    replacements = checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else checkpoint_dict_replacements_sd1
+
+    return {k: transform_checkpoint_dict_key(k, replacements) for k in header if k != "__metadata__"}
+
+
+def get_state_dict_shapes_from_header(header):
+    """Returns shapes of tensors in a safetensors file from its header, with keys changed in the same way get_state_dict_from_checkpoint changes them."""
+
+    return {key: tuple(header[k]["shape"]) for k, key in get_state_dict_keys_from_header(header).items()}
+
+
+def read_safetensors_header(filename):
+    """Returns the header of a safetensors file: a dict of key -> {"dtype", "shape", "data_offsets"}, plus "__metadata__"."""
+
+    import json
+
+    with open(filename, mode="rb") as file:
+        header_len = int.from_bytes(file.read(8), "little")
+        header = file.read(header_len)
+
+    assert header_len > 2 and header[0:2] in (b'{"', b"{'"), f"{filename} is not a safetensors file"
+
+    return json.loads(header)
+
+
 def read_metadata_from_safetensors(filename):
     import json
 
@@ -309,16 +356,141 @@ def read_metadata_from_safetensors(filename):
         return res
 
 
+safetensors_dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": getattr(torch, "float8_e4m3fn", None),
+    "F8_E5M2": getattr(torch, "float8_e5m2", None),
+}
+
+
+def read_safetensors_and_sha256(filename, device):
+    """
+    Reads a .safetensors file in a single pass: the file is read into memory in blocks, each block is fed into sha256,
+    and tensors are then created as views of the same memory. Returns a tuple of state dict and sha256 of the file.
+    """
+
+    size = os.path.getsize(filename)
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    hash_sha256 = hashlib.sha256()
+    blksize = 16 * 1024 * 1024
+
+    with open(filename, "rb") as file:
+        pos = 0
+        while pos < size:
+            count = file.readinto(view[pos:pos + blksize])
+            if not count:
+                raise EOFError(f"{filename} was truncated while reading")
+
+            hash_sha256.update(view[pos:pos + count])
+            pos += count
+
+    res = {key: tensor.to(device) for key, tensor in tensors_from_safetensors_buffer(buffer, filename).items()}
+
+    return res, hash_sha256.hexdigest()
+
+
+def tensors_from_safetensors_buffer(buffer, filename):
+    """Returns a state dict of CPU tensors for a .safetensors file that is in buffer; tensors share memory with buffer."""
+
+    import json
+
+    header_len = int.from_bytes(buffer[0:8], "little")
+    header = json.loads(bytes(buffer[8:8 + header_len]))
+    data_start = 8 + header_len
+
+    res = {}
+    for key, info in header.items():
+        if key == "__metadata__":
+            continue
+
+        dtype = safetensors_dtypes.get(info["dtype"])
+        assert dtype is not None, f"unsupported dtype {info['dtype']} for {key} in {filename}"
+
+        begin, end = info["data_offsets"]
+        element_size = torch.empty((), dtype=dtype).element_size()
+        if begin == end:
+            tensor = torch.empty(info["shape"], dtype=dtype)
+        elif (data_start + begin) % element_size != 0:
+            # misaligned tensors get their own memory
+            tensor = torch.frombuffer(buffer, dtype=torch.uint8, count=end - begin, offset=data_start + begin).clone().view(dtype).reshape(info["shape"])
+        else:
+            tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // element_size, offset=data_start + begin).reshape(info["shape"])
+
+        res[key] = tensor
+
+    return res
+
+
+def read_safetensors_mmap(filename):
+    """
+    Maps a .safetensors file into memory copy-on-write and returns a state dict of CPU tensors that are views into it.
+    As long as tensors are not written to, their memory is the file's pages in OS cache, shared by all processes that
+    map the same file.
+    """
+
+    with open(filename, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    return tensors_from_safetensors_buffer(buffer, filename)
+
+
+def read_state_dict_and_hash(checkpoint_info, map_location=None):
+    """
+    Same as read_state_dict, but if sha256 of a .safetensors checkpoint is not known yet, it is calculated from the data
+    that is read to load the checkpoint and stored in cache, so that the file is read once instead of twice.
+    """
+
+    title = f"checkpoint/{checkpoint_info.name}"
+    if not checkpoint_info.is_safetensors or shared.cmd_opts.no_hashing or hashes.sha256_from_cache(checkpoint_info.filename, title) is not None:
+        return read_state_dict(checkpoint_info.filename, map_location=map_location)
+
+    device = map_location or shared.weight_load_location or devices.get_optimal_device_name()
+    stat = os.stat(checkpoint_info.filename)
+
+    pl_sd, sha256 = read_safetensors_and_sha256(checkpoint_info.filename, device)
+    hashes.store_sha256(checkpoint_info.filename, title, sha256, stat=stat)
+
+    return get_state_dict_from_checkpoint(pl_sd)
+
+
+def read_checkpoint_state_dict(checkpoint_info, map_location=None):
+    """Same as read_state_dict_and_hash, but uses the checkpoint's fast-load file if there is an up-to-date one."""
+
+    res = sd_models_fast_load.load(checkpoint_info, map_location=map_location)
+    if res is not None:
+        return res
+
+    return read_state_dict_and_hash(checkpoint_info, map_location=map_location)
+
+
 def read_state_dict(checkpoint_file, print_global_state=False, map_location=None):
     _, extension = os.path.splitext(checkpoint_file)
     if extension.lower() == ".safetensors":
         device = map_location or shared.weight_load_location or devices.get_optimal_device_name()
 
-        if not shared.opts.disable_mmap_load_safetensors:
+        if shared.opts.shared_weights and str(device) == "cpu":
+            pl_sd = read_safetensors_mmap(checkpoint_file)
+        elif not shared.opts.disable_mmap_load_safetensors:
             pl_sd = safetensors.torch.load_file(checkpoint_file, device=device)
         else:
             pl_sd = safetensors.torch.load(open(checkpoint_file, 'rb').read())
             pl_sd = {k: v.to(device) for k, v in pl_sd.items()}
+    elif shared.opts.shared_weights and str(map_location or shared.weight_load_location) == "cpu":
+        try:
+            pl_sd = torch.load(checkpoint_file, map_location="cpu", mmap=True)
+        except RuntimeError:
+            # files in the legacy format can't be mapped
+            pl_sd = torch.load(checkpoint_file, map_location="cpu")
     else:
         pl_sd = torch.load(checkpoint_file, map_location=map_location or shared.weight_load_location)
 
@@ -330,20 +502,42 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
 
 
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
-    timer.record("calculate hash")
-
     if checkpoint_info in checkpoints_loaded:
+        sd_model_hash = checkpoint_info.calculate_shorthash()
+        timer.record("calculate hash")
+
         # use checkpoint cache
         print(f"Loading weights [{sd_model_hash}] from cache")
         # move to end as latest
         checkpoints_loaded.move_to_end(checkpoint_info)
         return checkpoints_loaded[checkpoint_info]
 
-    print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
-    res = read_state_dict(checkpoint_info.filename)
+    res = sd_models_prefetch.prefetcher.take(checkpoint_info)
+    if res is not None:
+        timer.record("wait for prefetched weights")
+        sd_model_hash = checkpoint_info.calculate_shorthash()
+        timer.record("calculate hash")
+
+        print(f"Loading weights [{sd_model_hash}] prefetched from {checkpoint_info.filename}")
+        return res
+
+    res = sd_models_fast_load.load(checkpoint_info)
+    if res is not None:
+        timer.record("load weights from fast-load file")
+        sd_model_hash = checkpoint_info.calculate_shorthash()
+        timer.record("calculate hash")
+
+        print(f"Loaded weights [{sd_model_hash}] for {checkpoint_info.filename} from fast-load file")
+        return res
+
+    print(f"Loading weights [{checkpoint_info.shorthash or 'hash is calculated while reading'}] from {checkpoint_info.filename}")
+    res = read_state_dict_and_hash(checkpoint_info)
     timer.record("load weights from disk")
 
+    # if the hash was unknown, it is in cache now, so this does not read the file again
+    checkpoint_info.calculate_shorthash()
+    timer.record("calculate hash")
+
     return res
 
 
@@ -365,11 +559,15 @@ class SkipWritingToConfig:
 def check_fp8(model):
     if model is None:
         return None
+    return fp8_storage_enabled(getattr(model, "is_sdxl", False))
+
+
+def fp8_storage_enabled(is_sdxl):
     if devices.get_optimal_device_name() == "mps":
         enable_fp8 = False
     elif shared.opts.fp8_storage == "Enable":
         enable_fp8 = True
-    elif getattr(model, "is_sdxl", False) and shared.opts.fp8_storage == "Enable for SDXL":
+    elif is_sdxl and shared.opts.fp8_storage == "Enable for SDXL":
         enable_fp8 = True
     else:
         enable_fp8 = False
@@ -433,16 +631,39 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     if shared.opts.sd_checkpoint_cache > 0:
         # cache newly loaded model
         checkpoints_loaded[checkpoint_info] = state_dict.copy()
+        checkpoints_loaded.move_to_end(checkpoint_info)
+
+    fast_load_keys = list(state_dict) if sd_models_fast_load.needs_saving(checkpoint_info) else None
+
+    tensor_hashes = sd_models_delta.tensor_hashes(checkpoint_info) if shared.opts.sd_checkpoint_delta_loading else None
+    unchanged_keys = sd_models_delta.unchanged_keys(model, checkpoint_info, tensor_hashes)
+    timer.record("compare tensor hashes")
+
+    # until loading is finished, it's not known which weights the model has
+    model.tensor_hashes = None
 
     if hasattr(model, "before_load_weights"):
         model.before_load_weights(state_dict)
 
+    for key in unchanged_keys:
+        state_dict.pop(key, None)
+
+    if unchanged_keys:
+        print(f"Weights for {len(unchanged_keys)} tensors are already in the model and won't be copied")
+
     model.load_state_dict(state_dict, strict=False)
     timer.record("apply weights to model")
 
     if hasattr(model, "after_load_weights"):
         model.after_load_weights(state_dict)
 
+    if fast_load_keys is not None:
+        try:
+            sd_models_fast_load.save(model, checkpoint_info, fast_load_keys)
+            timer.record("write fast-load file")
+        except Exception:
+            errors.report(f"Error writing fast-load file for {checkpoint_info.filename}", exc_info=True)
+
     del state_dict
 
     # Set is_sdxl_inpaint flag.
@@ -520,10 +741,13 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     model.first_stage_model.to(devices.dtype_vae)
     timer.record("apply dtype to VAE")
 
-    # clean up cache if limit is reached
-    while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
+    # clean up cache if limit is reached; with RAM budget, cache is limited by enforce_checkpoint_budgets() instead
+    while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache and not shared.opts.sd_checkpoints_ram_budget > 0:
         checkpoints_loaded.popitem(last=False)
 
+    model.sd_model_size = state_dict_size(model.state_dict())
+    model.tensor_hashes = tensor_hashes
+    model.tensor_hashes_variant = sd_models_fast_load.variant(checkpoint_info)
     model.sd_model_hash = sd_model_hash
     model.sd_model_checkpoint = checkpoint_info.filename
     model.sd_checkpoint_info = checkpoint_info
@@ -714,6 +938,7 @@ class SdModelData:
 
         if v is not None:
             self.loaded_sd_models.insert(0, v)
+            note_model_use(v)
 
 
 model_data = SdModelData()
@@ -745,6 +970,21 @@ def send_model_to_cpu(m):
     devices.torch_gc()
 
 
+def send_model_to_ram(m):
+    """
+    Same as send_model_to_cpu, for models that are kept in RAM to be used later. With the shared_weights option, their
+    weights are mapped from the checkpoint's fast-load file, so that other processes with the same model share that memory.
+    """
+
+    if m is not None and not m.lowvram and shared.opts.shared_weights:
+        try:
+            sd_models_fast_load.map_model_weights(m)
+        except Exception:
+            errors.report(f"Error mapping weights of {m.sd_checkpoint_info.title} from fast-load file", exc_info=True)
+
+    send_model_to_cpu(m)
+
+
 def model_target_device(m):
     if lowvram.is_needed(m):
         return devices.cpu
@@ -796,12 +1036,16 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
 
     timer.record("unload existing model")
 
+    checkpoint_config = sd_models_config.find_checkpoint_config_before_loading(checkpoint_info)
+
     if already_loaded_state_dict is not None:
         state_dict = already_loaded_state_dict
     else:
         state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
-    checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+    if checkpoint_config is None:
+        checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+
     clip_is_included_into_sd = any(x for x in [sd1_clip_weight, sd2_clip_weight, sdxl_clip_weight, sdxl_refiner_clip_weight] if x in state_dict)
 
     timer.record("find config")
@@ -841,7 +1085,14 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
             '': torch.float16,
         }
 
-    with sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(sd_model), weight_dtype_conversion=weight_dtype_conversion):
+        # load_model_weights does not convert depth model to float16 with --upcast-sampling
+        if shared.cmd_opts.upcast_sampling:
+            weight_dtype_conversion['depth_model'] = None
+
+    # tensors from a state dict that is kept in checkpoints_loaded can't become parameters of the model
+    assign = shared.opts.sd_checkpoint_cache == 0 and checkpoint_info not in checkpoints_loaded
+
+    with sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(sd_model), weight_dtype_conversion=weight_dtype_conversion, assign=assign):
         load_model_weights(sd_model, checkpoint_info, state_dict, timer)
 
     timer.record("load weights from state dict")
@@ -875,20 +1126,127 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
     return sd_model
 
 
+def checkpoint_budgets_enabled():
+    return shared.opts.sd_checkpoints_vram_budget > 0 or shared.opts.sd_checkpoints_ram_budget > 0
+
+
+def state_dict_size(state_dict):
+    """returns total size of tensors in state_dict, in bytes"""
+
+    return sum(v.nelement() * v.element_size() for v in state_dict.values() if isinstance(v, torch.Tensor))
+
+
+model_reuse_half_life = 600
+"""in seconds; see model_reuse_score()"""
+
+
+def note_model_use(model):
+    model.sd_model_reuse_score = model_reuse_score(model) + 1
+    model.sd_model_last_used = time.time()
+
+
+def model_reuse_score(model):
+    """
+    Returns a number predicting how likely the model is to be used again: the number of times it has been used, with each
+    use counting for half as much every model_reuse_half_life seconds. Models with lower score are unloaded first.
+    """
+
+    last_used = getattr(model, 'sd_model_last_used', None)
+    if last_used is None:
+        return 0
+
+    return model.sd_model_reuse_score * 0.5 ** ((time.time() - last_used) / model_reuse_half_life)
+
+
+def model_in_vram(model):
+    if model.lowvram:
+        return False
+
+    return next(model.parameters()).device.type != devices.cpu.type
+
+
+def enforce_checkpoint_budgets(current, timer, size=None):
+    """
+    Moves loaded models from VRAM to RAM, and from RAM to disk (unloading them), until they fit into memory budgets set
+    in settings (sd_checkpoints_vram_budget, sd_checkpoints_ram_budget). Models with lowest model_reuse_score() go first.
+    State dicts in checkpoints_loaded and the prefetched state dict count against the RAM budget and are dropped before any model.
+
+    current is the model that is going to be used and is never moved; it is counted as being in VRAM. size is its size in
+    bytes; it can be set to an estimate when the model is not loaded yet and current is None.
+    """
+
+    vram_budget = shared.opts.sd_checkpoints_vram_budget * 1024 ** 3
+    ram_budget = shared.opts.sd_checkpoints_ram_budget * 1024 ** 3
+
+    if size is None:
+        size = getattr(current, 'sd_model_size', 0)
+
+    others = [m for m in model_data.loaded_sd_models if m is not current]
+    candidates = sorted(others, key=model_reuse_score)
+
+    if vram_budget > 0:
+        vram_used = size + sum(getattr(m, 'sd_model_size', 0) for m in others if model_in_vram(m))
+
+        for m in candidates:
+            if vram_used <= vram_budget:
+                break
+
+            if not model_in_vram(m):
+                continue
+
+            print(f"Moving model {m.sd_checkpoint_info.title} to RAM to fit into VRAM budget")
+            send_model_to_ram(m)
+            vram_used -= getattr(m, 'sd_model_size', 0)
+            timer.record("send model to cpu")
+
+    if ram_budget > 0:
+        ram_used = sum(getattr(m, 'sd_model_size', 0) for m in others if not model_in_vram(m))
+        ram_used += sum(state_dict_size(x) for x in checkpoints_loaded.values())
+
+        prefetched = sd_models_prefetch.prefetcher.loaded
+        if prefetched is not None:
+            prefetched_size = state_dict_size(prefetched[1])
+            ram_used += prefetched_size
+
+            if ram_used > ram_budget:
+                sd_models_prefetch.prefetcher.discard(prefetched[0], "does not fit into RAM budget")
+                ram_used -= prefetched_size
+
+        while ram_used > ram_budget and checkpoints_loaded:
+            _, state_dict = checkpoints_loaded.popitem(last=False)
+            ram_used -= state_dict_size(state_dict)
+
+        for m in candidates:
+            if ram_used <= ram_budget:
+                break
+
+            if model_in_vram(m):
+                continue
+
+            print(f"Unloading model {m.sd_checkpoint_info.title} to fit into RAM budget")
+            model_data.loaded_sd_models.remove(m)
+            send_model_to_trash(m)
+            ram_used -= getattr(m, 'sd_model_size', 0)
+            timer.record("send model to trash")
+
+
 def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
     """
     Checks if the desired checkpoint from checkpoint_info is not already loaded in model_data.loaded_sd_models.
     If it is loaded, returns that (moving it to GPU if necessary, and moving the currently loadded model to CPU if necessary).
     If not, returns the model that can be used to load weights from checkpoint_info's file.
     If no such model exists, returns None.
-    Additionally deletes loaded models that are over the limit set in settings (sd_checkpoints_limit).
+    Additionally deletes loaded models that are over the limit set in settings (sd_checkpoints_limit), or, if memory
+    budgets are set, moves models between VRAM, RAM and disk to fit into them (see enforce_checkpoint_budgets).
     """
 
     if sd_model is not None and sd_model.sd_checkpoint_info.filename == checkpoint_info.filename:
         return sd_model
 
-    if shared.opts.sd_checkpoints_keep_in_cpu:
-        send_model_to_cpu(sd_model)
+    budgets = checkpoint_budgets_enabled()
+
+    if shared.opts.sd_checkpoints_keep_in_cpu and not shared.opts.sd_checkpoints_vram_budget > 0:
+        send_model_to_ram(sd_model)
         timer.record("send model to cpu")
 
     already_loaded = None
@@ -898,13 +1256,16 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
             already_loaded = loaded_model
             continue
 
-        if len(model_data.loaded_sd_models) > shared.opts.sd_checkpoints_limit > 0:
+        if not budgets and len(model_data.loaded_sd_models) > shared.opts.sd_checkpoints_limit > 0:
             print(f"Unloading model {len(model_data.loaded_sd_models)} over the limit of {shared.opts.sd_checkpoints_limit}: {loaded_model.sd_checkpoint_info.title}")
             del model_data.loaded_sd_models[i]
             send_model_to_trash(loaded_model)
             timer.record("send model to trash")
 
     if already_loaded is not None:
+        if budgets:
+            enforce_checkpoint_budgets(already_loaded, timer)
+
         send_model_to_device(already_loaded)
         timer.record("send model to device")
 
@@ -917,6 +1278,15 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
         print(f"Using already loaded model {already_loaded.sd_checkpoint_info.title}: done in {timer.summary()}")
         sd_vae.reload_vae_weights(already_loaded)
         return model_data.sd_model
+    elif budgets:
+        # size of the model is not known before it's loaded; file size is a close enough estimate
+        enforce_checkpoint_budgets(None, timer, size=os.path.getsize(checkpoint_info.filename))
+        print(f"Loading model {checkpoint_info.title} ({len(model_data.loaded_sd_models) + 1} loaded)")
+
+        model_data.sd_model = None
+        load_model(checkpoint_info)
+        enforce_checkpoint_budgets(model_data.sd_model, timer)
+        return model_data.sd_model
     elif shared.opts.sd_checkpoints_limit > 1 and len(model_data.loaded_sd_models) < shared.opts.sd_checkpoints_limit:
         print(f"Loading model {checkpoint_info.title} ({len(model_data.loaded_sd_models) + 1} out of {shared.opts.sd_checkpoints_limit})")
 
@@ -964,9 +1334,12 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
         send_model_to_cpu(sd_model)
         sd_hijack.model_hijack.undo_hijack(sd_model)
 
+    checkpoint_config = sd_models_config.find_checkpoint_config_before_loading(checkpoint_info)
+
     state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
-    checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
+    if checkpoint_config is None:
+        checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
 
     timer.record("find config")
 
@@ -2,7 +2,7 @@ import os
 
 import torch
 
-from modules import shared, paths, sd_disable_initialization, devices
+from modules import shared, paths, sd_disable_initialization, devices, cache, errors
 
 sd_configs_path = shared.sd_configs_path
 sd_repo_configs_path = os.path.join(paths.paths['Stable Diffusion'], "configs", "stable-diffusion")
@@ -25,6 +25,30 @@ config_alt_diffusion = os.path.join(sd_configs_path, "alt-diffusion-inference.ya
 config_alt_diffusion_m18 = os.path.join(sd_configs_path, "alt-diffusion-m18-inference.yaml")
 config_sd3 = os.path.join(sd_configs_path, "sd3-inference.yaml")
 
+architectures = {
+    config_default: "sd1",
+    config_inpainting: "sd1-inpainting",
+    config_instruct_pix2pix: "instruct-pix2pix",
+    config_sd2: "sd2",
+    config_sd2v: "sd2-v",
+    config_sd2_inpainting: "sd2-inpainting",
+    config_depth_model: "sd2-depth",
+    config_unclip: "sd2-unclip-l",
+    config_unopenclip: "sd2-unclip-h",
+    config_sdxl: "sdxl",
+    config_sdxl_refiner: "sdxl-refiner",
+    config_sdxl_inpainting: "sdxl-inpainting",
+    config_alt_diffusion: "alt-diffusion",
+    config_alt_diffusion_m18: "alt-diffusion-m18",
+    config_sd3: "sd3",
+}
+"""Maps config files to names of architectures, as reported by the API."""
+
+architecture_configs = {v: k for k, v in architectures.items()}
+
+architecture_sd2_unknown_prediction = "sd2-unknown-prediction"
+"""For SD2 models whose header does not tell whether they use v-prediction; weights are needed to find that out."""
+
 
 def is_using_v_parameterization_for_sd2(state_dict):
     """
@@ -69,62 +93,135 @@ def is_using_v_parameterization_for_sd2(state_dict):
     return out < -1
 
 
-def guess_model_config_from_state_dict(sd, filename):
-    sd2_cond_proj_weight = sd.get('cond_stage_model.model.transformer.resblocks.0.attn.in_proj_weight', None)
-    diffusion_model_input = sd.get('model.diffusion_model.input_blocks.0.0.weight', None)
-    sd2_variations_weight = sd.get('embedder.model.ln_final.weight', None)
+def guess_model_config_from_shapes(shapes, is_using_v_parameterization):
+    """
+    Returns config for a model from shapes of its tensors, a dict of key -> tuple. is_using_v_parameterization is
+    called for SD2 models to tell v-prediction models from epsilon-prediction ones; if it returns None, so does this
+    function.
+    """
+
+    sd2_cond_proj_weight = shapes.get('cond_stage_model.model.transformer.resblocks.0.attn.in_proj_weight', None)
+    diffusion_model_input = shapes.get('model.diffusion_model.input_blocks.0.0.weight', None)
+    sd2_variations_weight = shapes.get('embedder.model.ln_final.weight', None)
 
-    if "model.diffusion_model.x_embedder.proj.weight" in sd:
+    if "model.diffusion_model.x_embedder.proj.weight" in shapes:
         return config_sd3
 
-    if sd.get('conditioner.embedders.1.model.ln_final.weight', None) is not None:
-        if diffusion_model_input.shape[1] == 9:
+    if shapes.get('conditioner.embedders.1.model.ln_final.weight', None) is not None:
+        if diffusion_model_input[1] == 9:
             return config_sdxl_inpainting
         else:
             return config_sdxl
 
-    if sd.get('conditioner.embedders.0.model.ln_final.weight', None) is not None:
+    if shapes.get('conditioner.embedders.0.model.ln_final.weight', None) is not None:
         return config_sdxl_refiner
-    elif sd.get('depth_model.model.pretrained.act_postprocess3.0.project.0.bias', None) is not None:
+    elif shapes.get('depth_model.model.pretrained.act_postprocess3.0.project.0.bias', None) is not None:
         return config_depth_model
-    elif sd2_variations_weight is not None and sd2_variations_weight.shape[0] == 768:
+    elif sd2_variations_weight is not None and sd2_variations_weight[0] == 768:
         return config_unclip
-    elif sd2_variations_weight is not None and sd2_variations_weight.shape[0] == 1024:
+    elif sd2_variations_weight is not None and sd2_variations_weight[0] == 1024:
         return config_unopenclip
 
-    if sd2_cond_proj_weight is not None and sd2_cond_proj_weight.shape[1] == 1024:
-        if diffusion_model_input.shape[1] == 9:
+    if sd2_cond_proj_weight is not None and sd2_cond_proj_weight[1] == 1024:
+        if diffusion_model_input[1] == 9:
             return config_sd2_inpainting
-        elif is_using_v_parameterization_for_sd2(sd):
+
+        is_v = is_using_v_parameterization()
+        if is_v is None:
+            return None
+        elif is_v:
             return config_sd2v
         else:
             return config_sd2
 
     if diffusion_model_input is not None:
-        if diffusion_model_input.shape[1] == 9:
+        if diffusion_model_input[1] == 9:
             return config_inpainting
-        if diffusion_model_input.shape[1] == 8:
+        if diffusion_model_input[1] == 8:
             return config_instruct_pix2pix
 
-    if sd.get('cond_stage_model.roberta.embeddings.word_embeddings.weight', None) is not None:
-        if sd.get('cond_stage_model.transformation.weight').size()[0] == 1024:
+    if shapes.get('cond_stage_model.roberta.embeddings.word_embeddings.weight', None) is not None:
+        if shapes.get('cond_stage_model.transformation.weight')[0] == 1024:
             return config_alt_diffusion_m18
         return config_alt_diffusion
 
     return config_default
 
 
+def guess_model_config_from_state_dict(sd, filename):
+    shapes = {k: tuple(v.shape) for k, v in sd.items() if hasattr(v, 'shape')}
+
+    return guess_model_config_from_shapes(shapes, lambda: is_using_v_parameterization_for_sd2(sd))
+
+
+def is_using_v_parameterization_from_header(header):
+    """Same as is_using_v_parameterization_for_sd2, but only looks at the header of a safetensors file; returns None if the header does not tell."""
+
+    metadata = header.get("__metadata__", {})
+
+    prediction_type = metadata.get("modelspec.prediction_type")
+    if prediction_type:
+        return prediction_type == "v"
+
+    if "v_pred" in header:
+        return True
+
+    return None
+
+
+def guess_model_config_from_header(header):
+    """Returns config for a model from the header of its safetensors file, without reading any weights; returns None if the header is not enough."""
+
+    from modules import sd_models
+
+    shapes = sd_models.get_state_dict_shapes_from_header(header)
+
+    return guess_model_config_from_shapes(shapes, lambda: is_using_v_parameterization_from_header(header))
+
+
+def guess_model_architecture(info):
+    """
+    Returns name of the architecture of a checkpoint, detected from its safetensors header, or None for .ckpt files.
+    The result is cached, so this can be used to list architectures of all models without loading them.
+    """
+
+    if info is None or not info.is_safetensors:
+        return None
+
+    from modules import sd_models
+
+    def detect():
+        config = guess_model_config_from_header(sd_models.read_safetensors_header(info.filename))
+        return architectures.get(config, architecture_sd2_unknown_prediction)
+
+    try:
+        return cache.cached_data_for_file('safetensors-architecture', "checkpoint/" + info.name, info.filename, detect)
+    except Exception as e:
+        errors.display(e, f"detecting architecture of {info.filename}")
+        return None
+
+
 def find_checkpoint_config(state_dict, info):
     if info is None:
         return guess_model_config_from_state_dict(state_dict, "")
 
-    config = find_checkpoint_config_near_filename(info)
+    config = find_checkpoint_config_before_loading(info)
     if config is not None:
         return config
 
     return guess_model_config_from_state_dict(state_dict, info.filename)
 
 
+def find_checkpoint_config_before_loading(info):
+    """Returns config for a checkpoint found without reading its weights: from a .yaml file next to it or from its safetensors header; returns None if that's not possible."""
+
+    config = find_checkpoint_config_near_filename(info)
+    if config is not None:
+        return config
+
+    return architecture_configs.get(guess_model_architecture(info))
+
+
 def find_checkpoint_config_near_filename(info):
     if info is None:
         return None
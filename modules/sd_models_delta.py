@@ -0,0 +1,99 @@
+import hashlib
+import os
+
+from modules import cache, devices, errors, hashes, shared
+
+
+def read_tensor_hashes(filename):
+    """Calculates a hash of each tensor's bytes in a safetensors file; returns a dict of state dict key -> hash."""
+
+    from modules import sd_models
+
+    header = sd_models.read_safetensors_header(filename)
+    keys = sd_models.get_state_dict_keys_from_header(header)
+    blksize = 16 * 1024 * 1024
+
+    res = {}
+    with open(filename, "rb") as file:
+        data_start = 8 + int.from_bytes(file.read(8), "little")
+
+        for k, (begin, end) in sorted(((k, header[k]["data_offsets"]) for k in keys), key=lambda x: x[1][0]):
+            tensor_hash = hashlib.blake2b(digest_size=16)
+            tensor_hash.update(f'{header[k]["dtype"]}{header[k]["shape"]}'.encode("utf8"))
+
+            file.seek(data_start + begin)
+            remaining = end - begin
+            while remaining > 0:
+                chunk = file.read(min(blksize, remaining))
+                if not chunk:
+                    break
+
+                tensor_hash.update(chunk)
+                remaining -= len(chunk)
+
+            res[keys[k]] = tensor_hash.hexdigest()
+
+    return res
+
+
+def tensor_hashes(checkpoint_info):
+    """Returns per-tensor hashes of a .safetensors checkpoint, calculated once per version of the file and cached; None for .ckpt files."""
+
+    if not checkpoint_info.is_safetensors:
+        return None
+
+    try:
+        key = hashes.stat_key(os.stat(checkpoint_info.filename))
+
+        tensor_hashes_cache = cache.cache("safetensors-tensor-hashes")
+        res = tensor_hashes_cache.get(key)
+        if res is None:
+            res = read_tensor_hashes(checkpoint_info.filename)
+            tensor_hashes_cache[key] = res
+
+        return res
+    except Exception:
+        errors.report(f"Error calculating tensor hashes for {checkpoint_info.filename}", exc_info=True)
+        return None
+
+
+def delta_loading_possible(model):
+    if not shared.opts.sd_checkpoint_delta_loading or getattr(model, "tensor_hashes", None) is None:
+        return False
+
+    # a model that is converted to SSD has different layers from the checkpoint
+    if getattr(model, "is_ssd", False):
+        return False
+
+    # fp16 copies of weights made for fp8 storage must come from weights that were not stored as fp8
+    if devices.fp8 and shared.opts.cache_fp16_weight:
+        return False
+
+    return True
+
+
+def unchanged_keys(model, checkpoint_info, new_tensor_hashes):
+    """
+    Returns keys of parameters in a model that already have the values the checkpoint is going to put in them, so that
+    they do not have to be copied. Buffers are always loaded since they are small and some of them are changed after loading.
+    """
+
+    from modules import sd_models_fast_load, sd_vae
+
+    if new_tensor_hashes is None or not delta_loading_possible(model):
+        return set()
+
+    # weights converted to different dtypes are not the same even if they were the same in checkpoints
+    if model.tensor_hashes_variant != sd_models_fast_load.variant(checkpoint_info):
+        return set()
+
+    old_tensor_hashes = model.tensor_hashes
+    parameters = {name for name, _ in model.named_parameters()}
+
+    res = {k for k, h in new_tensor_hashes.items() if k in parameters and old_tensor_hashes.get(k) == h}
+
+    # an external VAE replaces the one from the checkpoint in the model
+    if sd_vae.loaded_vae_file is not None:
+        res = {k for k in res if not k.startswith("first_stage_model.")}
+
+    return res
@@ -0,0 +1,205 @@
+import json
+import os
+
+import safetensors.torch
+import torch
+
+from modules import cache, devices, errors, hashes, shared
+
+fast_load_dir = os.path.join(cache.cache_dir, "fast-load")
+
+keep_dtype_prefixes = ('first_stage_model', 'alphas_cumprod')
+"""Parameters that keep their dtype when the model is loaded in half precision; same as weight_dtype_conversion in sd_models.load_model()."""
+
+keep_dtype_prefixes_upcast = keep_dtype_prefixes + ('depth_model', )
+"""Same as keep_dtype_prefixes, for --upcast-sampling, which does not convert the depth model to float16."""
+
+
+def variant(checkpoint_info):
+    """Describes the form weights of a checkpoint take once loaded with current settings; a fast-load file made for one variant can't be used with another."""
+
+    from modules import sd_models
+
+    if shared.cmd_opts.no_half:
+        return "full"
+
+    is_sdxl = (checkpoint_info.architecture or "").startswith("sdxl")
+    if sd_models.fp8_storage_enabled(is_sdxl) and not shared.opts.cache_fp16_weight:
+        res = "fp8"
+    else:
+        res = "fp16"
+
+    if shared.cmd_opts.upcast_sampling:
+        res += "-upcast"
+
+    return res
+
+
+def fast_load_filename(checkpoint_info):
+    return os.path.join(fast_load_dir, f"{checkpoint_info.model_name}-{variant(checkpoint_info)}.safetensors")
+
+
+def source_id(checkpoint_info):
+    return hashes.stat_key(os.stat(checkpoint_info.filename))
+
+
+def read_valid_metadata(checkpoint_info, filename):
+    """Returns metadata of the fast-load file if it was made from the current version of the checkpoint for current settings, None otherwise."""
+
+    from modules import sd_models
+
+    if not os.path.isfile(filename):
+        return None
+
+    metadata = sd_models.read_safetensors_header(filename).get("__metadata__", {})
+    if metadata.get("source") != source_id(checkpoint_info) or metadata.get("variant") != variant(checkpoint_info):
+        return None
+
+    return metadata
+
+
+def load(checkpoint_info, map_location=None):
+    """
+    Returns state dict of a checkpoint read from its fast-load file: keys are already transformed and weights are already
+    in the dtype they are going to be used in. Returns None if there is no up-to-date fast-load file.
+    """
+
+    if not shared.opts.sd_checkpoint_fast_load_cache:
+        return None
+
+    filename = fast_load_filename(checkpoint_info)
+
+    try:
+        metadata = read_valid_metadata(checkpoint_info, filename)
+        if metadata is None:
+            return None
+
+        device = map_location or shared.weight_load_location or devices.get_optimal_device_name()
+        state_dict = safetensors.torch.load_file(filename, device=device)
+    except Exception:
+        errors.report(f"Error reading fast-load file {filename}", exc_info=True)
+        return None
+
+    # the checkpoint itself is not read, so its hash is taken from the fast-load file
+    title = f"checkpoint/{checkpoint_info.name}"
+    if metadata.get("sha256") and hashes.sha256_from_cache(checkpoint_info.filename, title) is None:
+        hashes.store_sha256(checkpoint_info.filename, title, metadata["sha256"])
+
+    return state_dict
+
+
+def needs_saving(checkpoint_info):
+    if not shared.opts.sd_checkpoint_fast_load_cache and not shared.opts.shared_weights:
+        return False
+
+    try:
+        return read_valid_metadata(checkpoint_info, fast_load_filename(checkpoint_info)) is None
+    except Exception:
+        return True
+
+
+def weights_to_save(model, keys, variant_name):
+    """Returns a dict of key -> (tensor, dtype) for weights of a model that has just loaded keys from a state dict, with dtypes of the variant."""
+
+    model_state_dict = model.state_dict()
+    parameters = {name for name, _ in model.named_parameters()}
+
+    keep_prefixes = keep_dtype_prefixes_upcast if variant_name.endswith("-upcast") else keep_dtype_prefixes
+
+    fp8_keys = set()
+    if variant_name.startswith("fp8"):
+        for name, module in model.named_modules():
+            if isinstance(module, (torch.nn.Conv2d, torch.nn.Linear)) and not name.startswith('first_stage_model'):
+                fp8_keys.update([f"{name}.weight", f"{name}.bias"])
+
+    res = {}
+    for key in keys:
+        tensor = model_state_dict.get(key)
+        if tensor is None or tensor.is_meta:
+            continue
+
+        dtype = tensor.dtype
+        if variant_name != "full" and key in parameters and tensor.is_floating_point():
+            if key in fp8_keys:
+                dtype = torch.float8_e4m3fn
+            elif not key.startswith(keep_prefixes):
+                dtype = torch.float16
+
+        res[key] = (tensor, dtype)
+
+    return res
+
+
+def save(model, checkpoint_info, keys):
+    """Writes weights of a model that has just loaded a checkpoint into the checkpoint's fast-load file; tensors are converted and written one by one."""
+
+    from modules import sd_models
+
+    dtype_names = {v: k for k, v in sd_models.safetensors_dtypes.items() if v is not None}
+    variant_name = variant(checkpoint_info)
+    filename = fast_load_filename(checkpoint_info)
+
+    weights = weights_to_save(model, keys, variant_name)
+
+    header = {
+        "__metadata__": {
+            "source": source_id(checkpoint_info),
+            "variant": variant_name,
+            "sha256": checkpoint_info.sha256 or "",
+        },
+    }
+
+    offset = 0
+    for key, (tensor, dtype) in weights.items():
+        size = tensor.nelement() * torch.empty((), dtype=dtype).element_size()
+        header[key] = {"dtype": dtype_names[dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + size]}
+        offset += size
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode("utf8")
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    os.makedirs(fast_load_dir, exist_ok=True)
+    tmp_filename = filename + f".{os.getpid()}.tmp"
+
+    with open(tmp_filename, "wb") as file:
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+
+        for tensor, dtype in weights.values():
+            data = tensor.detach().to(device="cpu", dtype=dtype).contiguous().reshape(-1).view(torch.uint8)
+            file.write(data.numpy().data)
+
+    os.replace(tmp_filename, filename)
+
+
+def map_model_weights(model):
+    """
+    Replaces parameters of a model that is kept in RAM with tensors mapped from its checkpoint's fast-load file, so that
+    all processes keeping the same checkpoint share one copy of its weights through OS file cache. Parameters that differ
+    from the file in dtype or shape, and those of an external VAE, keep their own memory.
+    """
+
+    from modules import sd_models
+
+    checkpoint_info = model.sd_checkpoint_info
+    filename = fast_load_filename(checkpoint_info)
+
+    if getattr(model, "tensor_hashes_variant", None) != variant(checkpoint_info) or read_valid_metadata(checkpoint_info, filename) is None:
+        return
+
+    mapped = sd_models.read_safetensors_mmap(filename)
+    parameters = dict(model.named_parameters())
+
+    state_dict = {}
+    for key, tensor in mapped.items():
+        param = parameters.get(key)
+        if param is None or param.is_meta or param.dtype != tensor.dtype or param.shape != tensor.shape:
+            continue
+
+        if getattr(model, "loaded_vae_file", None) is not None and key.startswith("first_stage_model."):
+            continue
+
+        state_dict[key] = tensor
+
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    print(f"Mapped {len(state_dict)} weights of {checkpoint_info.title} from fast-load file")
@@ -0,0 +1,172 @@
+import threading
+import time
+
+from modules import errors, shared
+
+lookahead_sources = []
+"""Functions returning names of checkpoints that work waiting outside of the main queue is going to need, in order."""
+
+task_checkpoints = {}
+"""Maps ids of queued tasks to names of checkpoints they have requested via override_settings."""
+
+
+def note_task(id_task, checkpoint_name):
+    """Records that a queued task is going to need a checkpoint, and starts loading it if it's the next one needed."""
+
+    if checkpoint_name:
+        task_checkpoints[id_task] = checkpoint_name
+        prefetcher.notify()
+
+
+def upcoming_checkpoints():
+    from modules import progress
+
+    for id_task in [progress.current_task, *progress.queued_task_ids()]:
+        name = task_checkpoints.get(id_task)
+        if name:
+            yield name
+
+    for source in lookahead_sources:
+        try:
+            yield from source()
+        except Exception:
+            errors.report("Error looking ahead for checkpoints to prefetch", exc_info=True)
+
+
+def upcoming_checkpoint_infos():
+    from modules import sd_models
+
+    for name in upcoming_checkpoints():
+        info = sd_models.get_closet_checkpoint_match(name)
+        if info is not None:
+            yield info
+
+
+def next_checkpoint():
+    """Returns CheckpointInfo for the first checkpoint queued work is going to need that is not loaded yet, or None."""
+
+    from modules import sd_models
+
+    loaded = {m.sd_checkpoint_info.filename for m in sd_models.model_data.loaded_sd_models}
+    loaded.update(info.filename for info in sd_models.checkpoints_loaded)
+
+    return next((info for info in upcoming_checkpoint_infos() if info.filename not in loaded), None)
+
+
+class CheckpointPrefetcher:
+    """Reads the state dict of the next checkpoint needed by queued work into RAM on a background thread.
+
+    Only one state dict is kept; sd_models.get_checkpoint_state_dict() takes it (waiting for it to finish loading if
+    necessary), so that switching to the checkpoint only requires applying the weights to the model.
+
+    A state dict that is not taken is discarded when a different checkpoint is loaded and no queued work needs it, when
+    it has been kept for longer than sd_checkpoint_prefetch_timeout, or when it does not fit into RAM budget. A discarded
+    checkpoint is not prefetched again until the next checkpoint load.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.done = threading.Event()
+        self.done.set()
+        self.loading = None
+        self.loaded = None
+        self.loaded_at = None
+        self.discarded = None
+        self.thread = None
+
+    def notify(self):
+        if not shared.opts.sd_checkpoint_prefetch:
+            return
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True, name="Checkpoint prefetch")
+            self.thread.start()
+
+        self.wakeup.set()
+
+    def run(self):
+        from modules import progress
+
+        while True:
+            self.wakeup.wait(timeout=60)
+            self.wakeup.clear()
+
+            timeout = shared.opts.sd_checkpoint_prefetch_timeout
+            loaded = self.loaded
+            if loaded is not None and timeout > 0 and time.time() - self.loaded_at > timeout:
+                self.discard(loaded[0], "not used in time")
+
+            for id_task in [x for x in list(task_checkpoints) if x not in progress.pending_tasks and x != progress.current_task]:
+                task_checkpoints.pop(id_task, None)
+
+            if not shared.opts.sd_checkpoint_prefetch:
+                continue
+
+            try:
+                # a state dict that has not been used yet is only replaced once no task needs it
+                loaded = self.loaded
+                if loaded is not None and any(info.filename == loaded[0].filename for info in upcoming_checkpoint_infos()):
+                    continue
+
+                info = next_checkpoint()
+                if info is not None and info.filename != self.discarded:
+                    self.load(info)
+            except Exception:
+                errors.report("Error prefetching checkpoint", exc_info=True)
+
+    def load(self, info):
+        from modules import sd_models
+
+        with self.lock:
+            self.loading = info
+            self.loaded = None
+            self.done.clear()
+
+        try:
+            print(f"Prefetching weights for {info.title}")
+            state_dict = sd_models.read_checkpoint_state_dict(info, map_location="cpu")
+
+            with self.lock:
+                self.loaded = (info, state_dict)
+                self.loaded_at = time.time()
+        finally:
+            with self.lock:
+                self.loading = None
+                self.done.set()
+
+    def take(self, info):
+        """Returns the prefetched state dict for checkpoint info and forgets it; returns None if it was not prefetched."""
+
+        with self.lock:
+            is_loading = self.loading is not None and self.loading.filename == info.filename
+
+        if is_loading:
+            self.done.wait()
+
+        with self.lock:
+            self.discarded = None
+            loaded = self.loaded
+            if loaded is not None and loaded[0].filename == info.filename:
+                self.loaded = None
+                return loaded[1]
+
+        if loaded is not None and not any(x.filename == loaded[0].filename for x in upcoming_checkpoint_infos()):
+            self.discard(loaded[0], "a different checkpoint is loaded")
+
+        return None
+
+    def discard(self, info, reason):
+        """Forgets the prefetched state dict if it is for checkpoint info."""
+
+        with self.lock:
+            if self.loaded is None or self.loaded[0] is not info:
+                return
+
+            self.loaded = None
+            self.discarded = info.filename
+
+        print(f"Discarding prefetched weights for {info.title}: {reason}")
+
+
+prefetcher = CheckpointPrefetcher()
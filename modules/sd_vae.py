@@ -2,7 +2,7 @@ import os
 import collections
 from dataclasses import dataclass
 
-from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashes
+from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashing_service, cache
 
 import glob
 from copy import deepcopy
@@ -31,7 +31,7 @@ def get_loaded_vae_hash():
     if loaded_vae_file is None:
         return None
 
-    sha256 = hashes.sha256(loaded_vae_file, 'vae')
+    sha256 = hashing_service.sha256(loaded_vae_file, f"vae/{get_filename(loaded_vae_file)}")
 
     return sha256[0:10] if sha256 else None
 
@@ -99,9 +99,11 @@ def refresh_vae_list():
     for path in paths:
         candidates += glob.iglob(path, recursive=True)
 
-    for filepath in candidates:
-        name = get_filename(filepath)
-        vae_dict[name] = filepath
+    with cache.stat_directories(sd_models.model_path, vae_path, shared.cmd_opts.ckpt_dir, shared.cmd_opts.vae_dir):
+        for filepath in candidates:
+            name = get_filename(filepath)
+            vae_dict[name] = filepath
+            hashing_service.service.submit(filepath, f"vae/{name}")
 
     vae_dict.update(dict(sorted(vae_dict.items(), key=lambda item: shared.natural_sort_key(item[0]))))
 
@@ -125,20 +127,22 @@ class VaeResolution:
         return self.vae, self.source
 
 
-def is_automatic():
-    return shared.opts.sd_vae in {"Automatic", "auto"}  # "auto" for people with old config
+def is_automatic(vae_setting=None):
+    vae_setting = shared.opts.sd_vae if vae_setting is None else vae_setting
+    return vae_setting in {"Automatic", "auto"}  # "auto" for people with old config
 
 
-def resolve_vae_from_setting() -> VaeResolution:
-    if shared.opts.sd_vae == "None":
+def resolve_vae_from_setting(vae_setting=None) -> VaeResolution:
+    vae_setting = shared.opts.sd_vae if vae_setting is None else vae_setting
+    if vae_setting == "None":
         return VaeResolution()
 
-    vae_from_options = vae_dict.get(shared.opts.sd_vae, None)
+    vae_from_options = vae_dict.get(vae_setting, None)
     if vae_from_options is not None:
         return VaeResolution(vae_from_options, 'specified in settings')
 
-    if not is_automatic():
-        print(f"Couldn't find VAE named {shared.opts.sd_vae}; using None instead")
+    if not is_automatic(vae_setting):
+        print(f"Couldn't find VAE named {vae_setting}; using None instead")
 
     return VaeResolution(resolved=False)
 
@@ -157,30 +161,32 @@ def resolve_vae_from_user_metadata(checkpoint_file) -> VaeResolution:
     return VaeResolution(resolved=False)
 
 
-def resolve_vae_near_checkpoint(checkpoint_file) -> VaeResolution:
+def resolve_vae_near_checkpoint(checkpoint_file, vae_setting=None) -> VaeResolution:
     vae_near_checkpoint = find_vae_near_checkpoint(checkpoint_file)
-    if vae_near_checkpoint is not None and (not shared.opts.sd_vae_overrides_per_model_preferences or is_automatic()):
+    if vae_near_checkpoint is not None and (not shared.opts.sd_vae_overrides_per_model_preferences or is_automatic(vae_setting)):
         return VaeResolution(vae_near_checkpoint, 'found near the checkpoint')
 
     return VaeResolution(resolved=False)
 
 
-def resolve_vae(checkpoint_file) -> VaeResolution:
+def resolve_vae(checkpoint_file, vae_setting=None) -> VaeResolution:
+    """Finds VAE to use with a checkpoint; vae_setting is the value of sd_vae setting to use instead of the one in opts."""
+
     if shared.cmd_opts.vae_path is not None:
         return VaeResolution(shared.cmd_opts.vae_path, 'from commandline argument')
 
-    if shared.opts.sd_vae_overrides_per_model_preferences and not is_automatic():
-        return resolve_vae_from_setting()
+    if shared.opts.sd_vae_overrides_per_model_preferences and not is_automatic(vae_setting):
+        return resolve_vae_from_setting(vae_setting)
 
     res = resolve_vae_from_user_metadata(checkpoint_file)
     if res.resolved:
         return res
 
-    res = resolve_vae_near_checkpoint(checkpoint_file)
+    res = resolve_vae_near_checkpoint(checkpoint_file, vae_setting)
     if res.resolved:
         return res
 
-    res = resolve_vae_from_setting()
+    res = resolve_vae_from_setting(vae_setting)
 
     return res
 
@@ -208,7 +214,9 @@ def load_vae(model, vae_file=None, vae_source="from unknown source"):
             print(f"Loading VAE weights {vae_source}: {vae_file}")
             store_base_vae(model)
 
-            vae_dict_1 = load_vae_dict(vae_file, map_location=shared.weight_load_location)
+            # cached VAEs stay on CPU, where with shared_weights their memory is mapped from the file
+            map_location = "cpu" if cache_enabled and shared.opts.shared_weights else shared.weight_load_location
+            vae_dict_1 = load_vae_dict(vae_file, map_location=map_location)
             _load_vae_dict(model, vae_dict_1)
 
             if cache_enabled:
@@ -126,6 +126,9 @@ options_templates.update(options_section(('system', "System", "system"), {
     "print_hypernet_extra": OptionInfo(False, "Print extra hypernetwork information to console."),
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
+    "hashing_service_enable": OptionInfo(False, "Calculate hashes of model files in background").info("checkpoints, VAEs, LoRAs and embeddings are hashed on a background thread after they are found; generation never waits for a hash, and infotext of an image made before the hash is ready does not include it"),
+    "hashing_service_rate_limit": OptionInfo(100, "Maximum reading speed for background hashing (MB/s)", gr.Number, {"precision": 0}).info("0 = unlimited; files needed by generation are read at full speed"),
+    "image_encoding_threads": OptionInfo(0, "Number of threads used to save and encode generated images", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}).info("0 = save images on the generation thread; otherwise images are compressed in background while the next batch is sampled"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
 }))
@@ -150,6 +153,10 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_jobs_result_ttl": OptionInfo(3600, "Keep results of asynchronous API jobs for", gr.Number, {"precision": 0}).info("in seconds; 0 = keep forever"),
+    "api_coalesce_max_batch_size": OptionInfo(1, "Maximum number of txt2img API requests to merge into one batch", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).info("1 = disable; queued requests without scripts that only differ in prompt, negative prompt and seed are generated together as one batch"),
+    "api_queue_max_depth": OptionInfo(0, "Maximum number of API requests waiting in queue", gr.Number, {"precision": 0}).info("0 = unlimited; requests over the limit are rejected with HTTP 429 and a Retry-After header; UI requests are never rejected"),
+    "api_result_cache_size": OptionInfo(0, "Size of on-disk cache for results of API requests with a fixed seed (MB)", gr.Number, {"precision": 0}).info("0 = disable; a request identical to an earlier one, with the same checkpoint, VAE and settings, is answered from cache without generating"),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -172,6 +179,13 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
     "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoints_vram_budget": OptionInfo(0.0, "VRAM budget for loaded checkpoints (GB)", gr.Number).info("0 = no limit; if this or the setting below is set, it replaces the limits above: least likely to be reused models are moved to RAM when over budget"),
+    "sd_checkpoints_ram_budget": OptionInfo(0.0, "RAM budget for loaded checkpoints (GB)", gr.Number).info("0 = no limit; least likely to be reused models and cached checkpoints are unloaded when over budget"),
+    "sd_checkpoint_prefetch": OptionInfo(False, "Prefetch checkpoints for queued requests").info("while a request is being generated, read weights of the next different checkpoint requested by queued API requests into RAM; uses RAM for one extra checkpoint"),
+    "sd_checkpoint_prefetch_timeout": OptionInfo(600, "Discard prefetched checkpoint weights that were not used for (sec)", gr.Number, {"precision": 0}).info("0 = keep until used or replaced; prefetched weights also count against RAM budget and are discarded first when over it"),
+    "sd_checkpoint_fast_load_cache": OptionInfo(False, "Keep converted copies of checkpoints on disk for faster loading").info("on first load with current precision settings, weights are written to cache/fast-load already converted to the dtype they are used in, so later loads skip conversion and unpickling of .ckpt files; uses disk space"),
+    "shared_weights": OptionInfo(False, "Share weights of checkpoints kept in RAM between webui processes").info("checkpoints in RAM, cached VAEs and Lora are memory-mapped from files on disk instead of copied, so several webui processes on one machine use the same memory; uses fast-load files in cache/fast-load for checkpoints"),
+    "sd_checkpoint_delta_loading": OptionInfo(False, "Only copy weights that differ when switching checkpoints").info("for .safetensors checkpoints; a hash of each tensor is calculated once per file and compared with the loaded model, so switching between fine-tunes that share a VAE or text encoder copies only what changed"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
@@ -239,6 +253,8 @@ options_templates.update(options_section(('optimizations', "Optimizations", "sd"
     "pad_cond_uncond": OptionInfo(False, "Pad prompt/negative prompt", infotext='Pad conds').info("improves performance when prompt and negative prompt have different lengths; changes seeds"),
     "pad_cond_uncond_v0": OptionInfo(False, "Pad prompt/negative prompt (v0)", infotext='Pad conds v0').info("alternative implementation for the above; used prior to 1.6.0 for DDIM sampler; overrides the above if set; WARNING: truncates negative prompt if it's too long; changes seeds"),
     "persistent_cond_cache": OptionInfo(True, "Persistent cond cache").info("do not recalculate conds from prompts if prompts have not changed since previous calculation"),
+    "cond_cache_size": OptionInfo(0, "Size of cache for conds of recently used prompts (MB)", gr.Number, {"precision": 0}).info("0 = disable, only remember the last prompt; requires persistent cond cache; conds are stored in VRAM and dropped when checkpoint, CLIP skip or emphasis changes"),
+    "text_encoder_chunk_cache_size": OptionInfo(0, "Size of cache for text encoder outputs of 75-token prompt chunks (MB)", gr.Number, {"precision": 0}).info("0 = disable; when a long prompt changes, only chunks that changed are encoded again; hit rate is reported by /sdapi/v1/cond-cache"),
     "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info("do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond commandline argument"),
     "fp8_storage": OptionInfo("Disable", "FP8 weight", gr.Radio, {"choices": ["Disable", "Enable for SDXL", "Enable"]}).info("Use FP8 to store Linear/Conv layers' weight. Require pytorch>=2.1.0."),
     "cache_fp16_weight": OptionInfo(False, "Cache FP16 weight for LoRA").info("Cache fp16 weight when enabling FP8, will increase the quality of LoRA. Use more system ram."),
@@ -12,7 +12,7 @@ import safetensors.torch
 import numpy as np
 from PIL import Image, PngImagePlugin
 
-from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes
+from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashing_service
 import modules.textual_inversion.dataset
 from modules.textual_inversion.learn_schedule import LearnRateScheduler
 
@@ -87,6 +87,12 @@ class Embedding:
         self.hash = v
         self.shorthash = self.hash[0:12]
 
+    def request_hash(self):
+        """If the hash is not known yet, moves the file ahead of files that are not needed right now in the hashing queue."""
+
+        if not self.hash and self.filename:
+            hashing_service.service.submit(self.filename, "textual_inversion/" + self.name, priority=hashing_service.PRIORITY_NEEDED, callback=self.set_hash)
+
 
 class DirWithTextualInversionEmbeddings:
     def __init__(self, path):
@@ -318,7 +324,7 @@ def create_embedding_from_data(data, name, filename='unknown embedding file', fi
 
     if filepath:
         embedding.filename = filepath
-        embedding.set_hash(hashes.sha256(filepath, "textual_inversion/" + name) or '')
+        embedding.set_hash(hashing_service.sha256(filepath, "textual_inversion/" + name, callback=embedding.set_hash, priority=hashing_service.PRIORITY_BACKGROUND) or '')
 
     return embedding
 
@@ -15,7 +15,9 @@ class ExtraNetworksPageCheckpoints(ui_extra_networks.ExtraNetworksPage):
         shared.refresh_checkpoints()
 
     def create_item(self, name, index=None, enable_filter=True):
-        checkpoint: sd_models.CheckpointInfo = sd_models.checkpoint_aliases.get(name)
+        with sd_models.checkpoints_lock:
+            checkpoint: sd_models.CheckpointInfo = sd_models.checkpoint_aliases.get(name)
+
         if checkpoint is None:
             return
 
@@ -37,8 +39,7 @@ class ExtraNetworksPageCheckpoints(ui_extra_networks.ExtraNetworksPage):
         }
 
     def list_items(self):
-        # instantiate a list to protect against concurrent modification
-        names = list(sd_models.checkpoints_list)
+        names = sd_models.checkpoint_tiles()
         for index, name in enumerate(names):
             item = self.create_item(name, index)
             if item is not None:
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+import torch
+
+lora_path = os.path.join(os.path.dirname(__file__), "..", "extensions-builtin", "Lora")
+
+
+@pytest.mark.usefixtures("initialize")
+def test_forward_per_sample_non_linear_module():
+    sys.path.insert(0, lora_path)
+    try:
+        import network
+    finally:
+        sys.path.remove(lora_path)
+
+    class NetworkModuleSquared(network.NetworkModule):
+        """changes weight by square of multiplier, so its output is not proportional to multiplier"""
+
+        def updown_depends_on_weight(self):
+            return True
+
+        def calc_updown(self, orig_weight):
+            return orig_weight * self.multiplier() ** 2, None
+
+    linear = torch.nn.Linear(4, 3)
+    net = network.Network("test", None)
+    module = NetworkModuleSquared(net, network.NetworkWeights(network_key="test", sd_key="diffusion_model_test", w={}, sd_module=linear))
+
+    x = torch.randn(3, 4)
+    multipliers = torch.tensor([0.0, 0.5, 2.0])
+
+    with torch.no_grad():
+        y = linear(x)
+        res = module.forward_per_sample(x, y, multipliers)
+        expected = torch.stack([y[i] + torch.nn.functional.linear(x[i], linear.weight * multipliers[i] ** 2) for i in range(len(x))])
+
+    assert torch.allclose(res, expected, atol=1e-6)
+    assert module.fixed_multiplier is None
@@ -1,3 +1,4 @@
+import time
 
 import pytest
 import requests
@@ -88,3 +89,57 @@ def test_txt2img_multiple_batches_performed(url_txt2img, simple_txt2img_request)
 def test_txt2img_batch_performed(url_txt2img, simple_txt2img_request):
     simple_txt2img_request["batch_size"] = 2
     assert requests.post(url_txt2img, json=simple_txt2img_request).status_code == 200
+
+
+def test_txt2img_job_performed(base_url, simple_txt2img_request):
+    response = requests.post(f"{base_url}/sdapi/v1/jobs/txt2img", json=simple_txt2img_request)
+    assert response.status_code == 200
+    job_id = response.json()["id"]
+
+    for _ in range(600):
+        status = requests.get(f"{base_url}/sdapi/v1/jobs/{job_id}").json()["status"]
+        if status not in ("queued", "running"):
+            break
+        time.sleep(0.1)
+
+    assert status == "done"
+
+    response = requests.get(f"{base_url}/sdapi/v1/jobs/{job_id}/result")
+    assert response.status_code == 200
+    assert len(response.json()["images"]) == 1
+
+
+def test_txt2img_multipart_response(url_txt2img, simple_txt2img_request):
+    simple_txt2img_request["response_format"] = "multipart"
+    response = requests.post(url_txt2img, json=simple_txt2img_request)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("multipart/mixed")
+
+
+def test_txt2img_result_cache(base_url, url_txt2img, simple_txt2img_request):
+    url_options = f"{base_url}/sdapi/v1/options"
+    pre_value = requests.get(url_options).json()["api_result_cache_size"]
+    assert requests.post(url_options, json={"api_result_cache_size": 64}).status_code == 200
+
+    def cache_stats():
+        return requests.get(f"{base_url}/sdapi/v1/result-cache").json()["stats"]
+
+    try:
+        # a seed that other tests do not use, so that the first request is not in cache already
+        simple_txt2img_request["seed"] = int(time.time())
+
+        before = cache_stats()
+        first = requests.post(url_txt2img, json=simple_txt2img_request)
+        assert first.status_code == 200
+        after_first = cache_stats()
+        assert after_first["misses"] == before["misses"] + 1
+        assert after_first["hits"] == before["hits"]
+
+        second = requests.post(url_txt2img, json=simple_txt2img_request)
+        assert second.status_code == 200
+        after_second = cache_stats()
+        assert after_second["hits"] == after_first["hits"] + 1
+        assert after_second["misses"] == after_first["misses"]
+        assert first.json()["images"] == second.json()["images"]
+    finally:
+        requests.post(url_options, json={"api_result_cache_size": pre_value})